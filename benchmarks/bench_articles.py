@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Measure the memory taken by 100k articles as the old __dict__ objects and
+as the current slotted Article, and how fast they encode and decode with
+unbiased.codec compared to the JSON snapshots and pickle.
+
+    python benchmarks/bench_articles.py [--count 100000] [--repeat 3]
+
+Needs unbiased to be importable, e.g. after 'pip install -e .'.
+"""
+
+import argparse
+import json
+import pickle
+import time
+import tracemalloc
+
+from unbiased import codec
+from unbiased.sources.base import Article
+
+
+class LegacyArticle(object):
+    # the Article from before it was a slotted tuple
+
+    def __init__(self, source, title, author, description, url, img):
+        self.source = source
+        self.title = title
+        self.author = author
+        self.description = description
+        self.url = url
+        self.img = img
+
+
+def sample_fields(count):
+    # every field is a new string, as it would be coming off the network,
+    # apart from the source, of which there are only a few
+    for i in range(count):
+        yield (
+            ''.join(['Source ', str(i % 20)]),
+            'A headline about something, number {}'.format(i),
+            'Author {}'.format(i % 500) if i % 7 else None,
+            'A description that goes on for a while, like they do. {}'.format(i) * 2,
+            'https://example.com/news/{}/a-headline-about-something'.format(i),
+            'https://images.example.com/{}.jpg'.format(i),
+        )
+
+
+def memory(make, count):
+    tracemalloc.start()
+    articles = [make(*x) for x in sample_fields(count)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del articles
+    return size
+
+
+def json_encode(articles):
+    return json.dumps([[x.source, x.title, x.author, x.description, x.url, x.img] for x in articles[0]], separators=(',', ':')).encode('utf8')
+
+
+def json_decode(data):
+    return (tuple(Article(*x) for x in json.loads(data.decode('utf8'))),)
+
+
+CODECS = [
+    ('unbiased.codec', codec.encode, codec.decode),
+    ('json', json_encode, json_decode),
+    ('pickle', lambda x: pickle.dumps(x, pickle.HIGHEST_PROTOCOL), pickle.loads),
+]
+
+
+def timed(func, arg, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    legacy = memory(LegacyArticle, args.count)
+    current = memory(Article, args.count)
+    print('memory per {} articles, strings included:'.format(args.count))
+    print('  __dict__ objects: {:8.1f} MiB, {:5.0f} bytes each'.format(legacy / 2 ** 20, legacy / args.count))
+    print('  slotted Article:  {:8.1f} MiB, {:5.0f} bytes each'.format(current / 2 ** 20, current / args.count))
+
+    groups = (tuple(Article(*x) for x in sample_fields(args.count)),)
+    print('{:16} {:>10} {:>14} {:>14}'.format('codec', 'MiB', 'encode (k/s)', 'decode (k/s)'))
+    for name, encode, decode in CODECS:
+        encode_time, data = timed(encode, groups, args.repeat)
+        decode_time, decoded = timed(decode, data, args.repeat)
+        assert decoded == groups, name
+        print('{:16} {:>10.1f} {:>14.0f} {:>14.0f}'.format(
+            name, len(data) / 2 ** 20, args.count / encode_time / 1000, args.count / decode_time / 1000))
+
+
+if __name__ == '__main__':
+    main()
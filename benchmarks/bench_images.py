@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Compare the CPU time and peak memory of shrinking one image with the old
+full-decode path against unbiased.util.resize_image.
+
+    python benchmarks/bench_images.py [--size 4000x3000] [--repeat 10]
+
+Every measurement runs in a fresh process so that peak RSS isn't shared.
+Needs unbiased to be importable, e.g. after 'pip install -e .'.
+"""
+
+import argparse
+import io
+import multiprocessing
+import time
+
+from PIL import Image, ImageFilter
+
+from unbiased.util import resize_image
+
+from harness import peak_rss
+
+
+def legacy_resize(content, target_width, target_height):
+    # the image pipeline before draft/reduced decoding
+    img = Image.open(io.BytesIO(content))
+    target_ar = target_width / target_height
+    left, top, right, bottom = img.getbbox()
+    height = bottom - top
+    width = right - left
+    ar = width / height
+    if target_ar > ar:
+        new_height = (target_height / target_width) * width
+        bbox = (left, top + ((height - new_height) / 2), right, bottom - ((height - new_height) / 2))
+        img = img.crop(bbox)
+    elif target_ar < ar:
+        new_width = (target_width / target_height) * height
+        bbox = (left + ((width - new_width) / 2), top, right - ((width - new_width) / 2), bottom)
+        img = img.crop(bbox)
+    if target_width * 2 < width or target_height * 2 < height:
+        img = img.resize((target_width * 2, target_height * 2), Image.LANCZOS)
+    img = img.convert('RGB')
+    jpg_file = io.BytesIO()
+    img.save(jpg_file, 'JPEG')
+    jpg_file.seek(0)
+    return jpg_file
+
+
+def current_resize(content, target_width, target_height):
+    img = resize_image(content, target_width, target_height)
+    jpg_file = io.BytesIO()
+    img.save(jpg_file, 'JPEG')
+    jpg_file.seek(0)
+    return jpg_file
+
+
+PATHS = {
+    'before': legacy_resize,
+    'after': current_resize,
+}
+
+
+def sample_image(width, height, fmt):
+    # noise, blurred a little so it compresses like a photo
+    img = Image.effect_noise((width, height), 64).convert('RGB')
+    img = img.filter(ImageFilter.GaussianBlur(2))
+    data = io.BytesIO()
+    if fmt == 'JPEG':
+        img.save(data, fmt, quality=90)
+    else:
+        img.save(data, fmt)
+    return data.getvalue()
+
+
+def measure(path, content, target, repeat):
+    func = PATHS[path]
+    base_rss = peak_rss(reset=True)
+    start = time.process_time()
+    for _ in range(repeat):
+        func(content, *target)
+    cpu = (time.process_time() - start) / repeat
+    return cpu, peak_rss() - base_rss
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', default='4000x3000', help='source image size')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    width, height = [int(x) for x in args.size.split('x')]
+
+    ctx = multiprocessing.get_context('spawn')
+    print('{:6} {:9} {:>6} {:>10} {:>14}'.format('format', 'target', 'path', 'cpu (ms)', 'peak rss (KiB)'))
+    for fmt in ['JPEG', 'PNG']:
+        content = sample_image(width, height, fmt)
+        for target in [(350, 200), (150, 100)]:
+            for path in ['before', 'after']:
+                with ctx.Pool(1) as pool:
+                    cpu, rss = pool.apply(measure, (path, content, target, args.repeat))
+                print('{:6} {:9} {:>6} {:>10.1f} {:>14}'.format(
+                    fmt, '{}x{}'.format(*target), path, cpu * 1000, rss))
+
+
+if __name__ == '__main__':
+    main()
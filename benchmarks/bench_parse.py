@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Compare the CPU time of fetching and parsing every recorded html page
+the old way, decoding the body to a str (sniffing its charset with
+chardet if the headers don't give one) and handing that to
+BeautifulSoup, against handing the bytes to lxml in the charset from the
+headers or <meta> tags.
+
+    python benchmarks/bench_parse.py fixtures/ [--repeat 5] [--strip-charset]
+
+The fixtures are recorded by bench_sources.py. With --strip-charset the
+charset is taken out of every Content-Type header, as plenty of sites
+leave it out. Needs unbiased to be importable, e.g. after
+'pip install -e .'.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+
+import requests
+from bs4 import BeautifulSoup
+
+from unbiased import fetch
+from unbiased.page import parse_html
+
+from harness import ReplayAdapter
+
+
+class StrippedReplayAdapter(ReplayAdapter):
+
+    def send(self, request, **kwargs):
+        res = super().send(request, **kwargs)
+        res.headers['Content-Type'] = res.headers.get('Content-Type', '').split(';')[0]
+        res.encoding = None
+        return res
+
+
+def legacy_parse(res):
+    # what fetch.Response.text and NewsSource._parse used to do
+    encoding = requests.utils.get_encoding_from_headers(res.headers)
+    if encoding is None:
+        encoding = requests.compat.chardet.detect(res.content)['encoding']
+    try:
+        text = str(res.content, encoding or 'utf-8', errors='replace')
+    except LookupError:
+        text = str(res.content, errors='replace')
+    return BeautifulSoup(text, 'lxml')
+
+
+PATHS = {
+    'before': legacy_parse,
+    'after': parse_html,
+}
+
+
+def html_pages(directory):
+    urls = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.json'):
+            continue
+        with open(os.path.join(directory, filename)) as fp:
+            meta = json.load(fp)
+        content_type = {k.lower(): v for k, v in meta['headers'].items()}.get('content-type', '')
+        if meta['status'] == 200 and meta['method'] == 'GET' and content_type.startswith('text/html'):
+            urls.append(meta['url'])
+    return urls
+
+
+def measure(url, parse, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.process_time()
+        parse(fetch.get(url))
+        times.append(time.process_time() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('fixtures', help='directory of responses recorded by bench_sources.py')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--strip-charset', action='store_true', help='leave the charset out of the headers')
+    args = parser.parse_args()
+
+    adapter_type = StrippedReplayAdapter if args.strip_charset else ReplayAdapter
+    fetch.configure(transport=adapter_type(args.fixtures))
+    urls = html_pages(args.fixtures)
+    if not urls:
+        print('No html pages in {}'.format(args.fixtures))
+        return
+
+    totals = {x: 0.0 for x in PATHS}
+    print('{:>10} {:>12} {:>12}  {}'.format('bytes', 'before (ms)', 'after (ms)', 'url'))
+    for url in urls:
+        results = {x: measure(url, parse, args.repeat) for x, parse in PATHS.items()}
+        for path, cpu in results.items():
+            totals[path] += cpu
+        print('{:>10} {:>12.2f} {:>12.2f}  {}'.format(len(fetch.get(url).content), results['before'] * 1000, results['after'] * 1000, url))
+    print('{:>10} {:>12.2f} {:>12.2f}  {} pages'.format('total', totals['before'] * 1000, totals['after'] * 1000, len(urls)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Time picking the stories for the page with the old shuffle-everything
+pick_randoms against the current one, and check how fairly each treats
+sources with fewer stories than they may have picked.
+
+    python benchmarks/bench_picker.py [--sources 100] [--stories 30] [--repeat 200]
+
+Needs unbiased to be importable, e.g. after 'pip install -e .'.
+"""
+
+import argparse
+import collections
+import random
+import time
+
+from unbiased import util
+
+
+def legacy_pick_randoms(story_lists, length, per_source):
+    # pick_randoms before the weighted picker
+    urandom = random.SystemRandom()
+    candidates = []
+    for stories in story_lists:
+        indexes = list(range(len(stories)))
+        urandom.shuffle(indexes)
+        random_indexes = indexes[:per_source]
+        candidates.extend([stories[x] for x in random_indexes])
+    indexes = list(range(len(candidates)))
+    urandom.shuffle(indexes)
+    random_indexes = indexes[:length]
+    return tuple(candidates[x] for x in random_indexes)
+
+
+PATHS = {
+    'before': legacy_pick_randoms,
+    'after': util.pick_randoms,
+}
+
+
+def timed(func, story_lists, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(story_lists, 12, 2)
+    return (time.perf_counter() - start) / repeat
+
+
+def fairness(func, repeat):
+    # half the sources have a single story, the other half plenty, and
+    # every source should be picked as often as any other
+    story_lists = [[(i, j) for j in range(1 if i % 2 else 10)] for i in range(10)]
+    counts = collections.Counter()
+    for _ in range(repeat):
+        for source, _ in func(story_lists, 4, 2):
+            counts[source % 2] += 1
+    return counts[1] / max(1, counts[0])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sources', type=int, default=100)
+    parser.add_argument('--stories', type=int, default=30, help='stories per source')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    util.seed_picker(0)
+    story_lists = [[(i, j) for j in range(args.stories)] for i in range(args.sources)]
+    print('{} sources of {} stories, 12 picked, at most 2 per source'.format(args.sources, args.stories))
+    for path, func in PATHS.items():
+        elapsed = timed(func, story_lists, args.repeat)
+        ratio = fairness(func, args.repeat * 10)
+        print('{:>6}: {:8.3f} ms per pick, small sources picked {:.2f}x as often as big ones'.format(path, elapsed * 1000, ratio))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Time how long it takes to get the sources to crawl, in a fresh process,
+with the old way of importing every source module against the registry,
+for the built-in sources and for hundreds of generated plugin sources.
+
+    python benchmarks/bench_registry.py [--plugins 10,100,500] [--repeat 5]
+
+The plugin sources are installed into a temporary directory as a
+package with 'unbiased.sources' entry points. Needs unbiased to be
+importable, e.g. after 'pip install -e .'.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import textwrap
+
+# the old get_sources(), which imported every module under a package.
+# base classes without a shortname, like DeclarativeSource, aren't sources.
+LEGACY = '''
+import importlib, pkgutil
+from unbiased.sources.base import NewsSource
+def walk(package):
+    for loader, name, is_pkg in pkgutil.walk_packages(package.__path__):
+        if name != 'base':
+            importlib.import_module(package.__name__ + '.' + name)
+import unbiased.sources
+walk(unbiased.sources)
+{walk_plugins}
+sources = {{x.shortname.lower(): x for x in NewsSource.__subclasses__() if x.shortname}}
+sources[{name!r}]
+'''
+
+REGISTRY_ONE = '''
+from unbiased.sources import get_sources
+get_sources([{name!r}])
+'''
+
+REGISTRY_ALL = '''
+from unbiased.sources import get_sources
+get_sources()
+'''
+
+TIMED = '''
+import time
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+'''
+
+
+def make_plugins(directory, count):
+    package = os.path.join(directory, 'benchsources')
+    os.makedirs(package)
+    open(os.path.join(package, '__init__.py'), 'w').close()
+    entry_points = []
+    for i in range(count):
+        with open(os.path.join(package, 'source{}.py'.format(i)), 'w') as fp:
+            fp.write(textwrap.dedent('''
+                from unbiased.sources.base import NewsSource
+
+                class Source{0}(NewsSource):
+                    name = 'Source {0}'
+                    shortname = 'source{0}'
+                    url = 'https://source{0}.example.com/'
+                    bad_titles = ['Opinion']
+            '''.format(i)))
+        entry_points.append('source{0} = benchsources.source{0}:Source{0}'.format(i))
+    dist_info = os.path.join(directory, 'benchsources-0.dist-info')
+    os.makedirs(dist_info)
+    with open(os.path.join(dist_info, 'METADATA'), 'w') as fp:
+        fp.write('Metadata-Version: 2.1\nName: benchsources\nVersion: 0\n')
+    with open(os.path.join(dist_info, 'entry_points.txt'), 'w') as fp:
+        fp.write('[unbiased.sources]\n' + '\n'.join(entry_points) + '\n')
+
+
+def timed(code, path, repeat):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(x for x in [path, env.get('PYTHONPATH')] if x)
+    # a warm-up run, so every run finds the bytecode already compiled
+    subprocess.check_output([sys.executable, '-c', code], env=env)
+    times = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', TIMED.format(code=code)], env=env)
+        times.append(float(output))
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--plugins', default='10,100,500', help='numbers of plugin sources to try')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print('{:>8} {:>14} {:>14} {:>14}'.format('plugins', 'legacy (ms)', 'one (ms)', 'all (ms)'))
+    for count in [0] + [int(x) for x in args.plugins.split(',')]:
+        with tempfile.TemporaryDirectory() as directory:
+            walk_plugins = ''
+            if count:
+                make_plugins(directory, count)
+                walk_plugins = 'import benchsources\nwalk(benchsources)'
+            legacy = timed(LEGACY.format(walk_plugins=walk_plugins, name='npr'), directory, args.repeat)
+            one = timed(REGISTRY_ONE.format(name='npr'), directory, args.repeat)
+            every = timed(REGISTRY_ALL, directory, args.repeat)
+        print('{:>8} {:>14.1f} {:>14.1f} {:>14.1f}'.format(count, legacy * 1000, one * 1000, every * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Time rendering the page with a fresh jinja environment per call (as every
+crawl used to) against the cached template, and the cost of precompressing
+the result.
+
+    python benchmarks/bench_render.py [--repeat 200]
+
+Needs unbiased to be importable, e.g. after 'pip install -e .'.
+"""
+
+import argparse
+import tempfile
+import time
+
+from unbiased import publish, util
+from unbiased.sources.base import Article
+
+
+def sample_stories():
+    def story(tier, i, with_img):
+        img = util.Picture('img/{}{}'.format(tier, i), util.image_formats()) if with_img else None
+        return Article(
+            'Source {}'.format(i % 10),
+            'A headline about something & other things <{}>'.format(i),
+            'Author {}'.format(i),
+            'A description that goes on for a while, like they do. ' * 3,
+            'https://example.com/{}/{}'.format(tier, i),
+            'https://example.com/{}/{}.jpg'.format(tier, i),
+            img,
+        )
+    top = tuple(story('top', i, True) for i in range(4))
+    middle = tuple(story('middle', i, True) for i in range(6))
+    bottom = tuple(story('bottom', i, False) for i in range(12))
+    return top, middle, bottom
+
+
+def fresh_environment(*stories):
+    util._template = None
+    return util.buildOutput(*stories)
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    stories = sample_stories()
+    uncached, _ = timed(lambda: fresh_environment(*stories), args.repeat)
+    util.setup_templates()
+    cached, html = timed(lambda: util.buildOutput(*stories), args.repeat)
+    with tempfile.TemporaryDirectory() as bytecode_dir:
+        util.setup_templates(bytecode_dir)
+        util.setup_templates(bytecode_dir)
+        util._template = None
+        warm_start, _ = timed(lambda: util.setup_templates(bytecode_dir), args.repeat)
+    print('render, new environment:    {:8.3f} ms'.format(uncached * 1000))
+    print('render, cached template:    {:8.3f} ms'.format(cached * 1000))
+    print('compile from bytecode:      {:8.3f} ms'.format(warm_start * 1000))
+
+    data = html.encode('utf8')
+    for suffix, compress in publish.compressors():
+        elapsed, compressed = timed(lambda: compress(data), args.repeat)
+        print('compress {:3} {:6d} -> {:6d} bytes: {:8.3f} ms'.format(suffix, len(data), len(compressed), elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
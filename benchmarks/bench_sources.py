@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Benchmark every stage of a crawl against recorded copies of the sources,
+so changes can be measured without hitting the live sites.
+
+First record the home pages, articles and images of every source (or
+just some, with --sources) into a fixture directory:
+
+    python benchmarks/bench_sources.py record fixtures/
+
+then replay them as many times as needed:
+
+    python benchmarks/bench_sources.py run fixtures/ [--repeat 5] [--latency 0.05]
+
+The run reports wall time, CPU time and peak RSS growth for building each
+source, picking the stories, downloading and transcoding the images and
+rendering the page. Needs unbiased to be importable, e.g. after
+'pip install -e .'.
+"""
+
+import argparse
+import concurrent.futures
+import logging
+import statistics
+import tempfile
+
+from unbiased import fetch, politeness, util
+from unbiased.sources import get_sources
+from unbiased.sources.base import NewsSource
+
+from harness import RecordingAdapter, ReplayAdapter, Stages
+
+logger = logging.getLogger('unbiased')
+
+
+def select(source_names):
+    sources = get_sources(source_names or None)
+    return [sources[x] for x in sorted(sources)]
+
+
+def build(source, concurrency):
+    if concurrency > 1:
+        with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+            return source.build(pool)
+    return source.build()
+
+
+def record(args):
+    adapter = RecordingAdapter(args.fixtures)
+    fetch.configure(transport=adapter)
+    built_sources = []
+    for source in select(args.sources):
+        try:
+            built_sources.append(build(source, args.concurrency))
+        except Exception as ex:
+            logger.warning('Build failed: source={} ex={}'.format(source.name, ex))
+    # every image, since any story can be picked
+    urls = set(x.img for built in built_sources for tier in [built.h1s, built.h2s, built.h3s] for x in tier if x.img)
+
+    def get_image(url):
+        try:
+            fetch.get(url, check_head=util.check_image_head)
+        except Exception as ex:
+            logger.warning('Image download failed: url={} ex={}'.format(url, ex))
+    with concurrent.futures.ThreadPoolExecutor(max(1, args.concurrency)) as pool:
+        list(pool.map(get_image, sorted(urls)))
+    print('Recorded {} responses from {} sources to {}'.format(adapter.recorded, len(built_sources), args.fixtures))
+
+
+def run_once(sources, concurrency, seed):
+    stages = Stages()
+    util.seed_picker(seed)
+    built_sources = []
+    for source in sources:
+        with stages.measure('build {}'.format(source.shortname)):
+            try:
+                built_sources.append(build(source, concurrency))
+            except Exception as ex:
+                logger.warning('Build failed: source={} ex={}'.format(source.name, ex))
+
+    with stages.measure('pickStories'):
+        top_stories, middle_stories, bottom_stories = util.pickStories(built_sources)
+
+    jobs = [(x, 350, 200) for x in top_stories] + [(x, 150, 100) for x in middle_stories]
+    with tempfile.TemporaryDirectory() as webroot:
+        with stages.measure('pullImage'):
+            downloads = [util.pullImage(story.img, webroot, width, height) if story.img else (None, None) for story, width, height in jobs]
+        with stages.measure('transcode'):
+            for (story, width, height), (picture, content) in zip(jobs, downloads):
+                if content is not None:
+                    util.transcode_image(content, picture, width, height)
+
+    stories = [story._replace(image=picture) for (story, _, _), (picture, _) in zip(jobs, downloads)]
+    top_stories = tuple(stories[:len(top_stories)])
+    middle_stories = tuple(stories[len(top_stories):])
+    with stages.measure('buildOutput'):
+        util.buildOutput(top_stories, middle_stories, bottom_stories)
+    return stages.measurements
+
+
+def run(args):
+    adapter = ReplayAdapter(args.fixtures, args.latency)
+    fetch.configure(transport=adapter)
+    # the replayed hosts don't need sparing, so unless asked to, don't
+    # count the time spent waiting on them
+    politeness.configure(enable=args.polite)
+    sources = select(args.sources)
+    util.setup_templates()
+    runs = [run_once(sources, args.concurrency, args.seed) for _ in range(args.repeat)]
+    if adapter.missing:
+        print('{} requests were not recorded, and got a 404'.format(len(adapter.missing)))
+        for url in sorted(adapter.missing):
+            logger.debug('Not recorded: url={}'.format(url))
+
+    print('{:24} {:>10} {:>10} {:>14}'.format('stage', 'wall (ms)', 'cpu (ms)', 'peak rss (KiB)'))
+    for measurements in zip(*runs):
+        print('{:24} {:>10.1f} {:>10.1f} {:>14}'.format(
+            measurements[0].stage,
+            statistics.median(x.wall for x in measurements) * 1000,
+            statistics.median(x.cpu for x in measurements) * 1000,
+            max(x.rss for x in measurements),
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['record', 'run'])
+    parser.add_argument('fixtures', help='directory the responses are recorded to and replayed from')
+    parser.add_argument('--sources', nargs='*', help='short names of the sources to crawl, default all')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs to take the median of')
+    parser.add_argument('--latency', type=float, default=0, help='seconds every replayed request takes')
+    parser.add_argument('-c', '--concurrency', type=int, default=1, help='threads to fetch the articles of a source with')
+    parser.add_argument('--seed', type=int, default=0, help='seed for picking stories, so every run picks the same')
+    parser.add_argument('--prefer-feeds', action='store_true', help='build sources from their feeds where they have one')
+    parser.add_argument('--polite', action='store_true', help='rate limit the replayed requests as if they were live')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING, format='%(levelname)s %(message)s')
+    NewsSource.prefer_feeds = args.prefer_feeds
+    if args.command == 'record':
+        record(args)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Shared pieces of the benchmarks: transport adapters that record every
+response unbiased gets to a fixture directory and replay them later
+without touching the network, and a way to measure each stage of a run.
+
+A fixture is two files named after the sha1 of the request method and
+url: '<key>.json' with the url, status and headers, and '<key>.body'
+with the (already decoded) body. Redirects are recorded hop by hop.
+"""
+
+import collections
+import contextlib
+import hashlib
+import io
+import json
+import logging
+import os
+import resource
+import threading
+import time
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+logger = logging.getLogger('unbiased')
+
+# headers that describe the body as it went over the wire, which the
+# recorded body no longer is
+_wire_headers = ['content-encoding', 'content-length', 'transfer-encoding']
+
+
+def fixture_key(method, url):
+    return hashlib.sha1('{} {}'.format(method, url).encode('utf8')).hexdigest()
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    Sends requests as usual and saves every response to 'directory'.
+    """
+
+    def __init__(self, directory, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory
+        self.recorded = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def send(self, request, **kwargs):
+        res = super().send(request, **kwargs)
+        # reads the whole body, which later reads of the response are
+        # then served from
+        body = res.content
+        headers = {k: v for k, v in res.headers.items() if k.lower() not in _wire_headers}
+        meta = {
+            'url': request.url,
+            'method': request.method,
+            'status': res.status_code,
+            'reason': res.reason,
+            'headers': headers,
+        }
+        path = os.path.join(self.directory, fixture_key(request.method, request.url))
+        with open(path + '.body', 'wb') as fp:
+            fp.write(body)
+        with open(path + '.json', 'w') as fp:
+            json.dump(meta, fp, indent=1)
+        with self._lock:
+            self.recorded += 1
+        logger.debug('Recorded: url={} status={} bytes={}'.format(request.url, res.status_code, len(body)))
+        return res
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    Answers requests from the fixtures in 'directory', after waiting
+    'latency' seconds to stand in for the network. Requests that weren't
+    recorded get a 404.
+    """
+
+    def __init__(self, directory, latency=0):
+        super().__init__()
+        self.directory = directory
+        self.latency = latency
+        self.missing = set()
+        self._lock = threading.Lock()
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if self.latency:
+            time.sleep(self.latency)
+        path = os.path.join(self.directory, fixture_key(request.method, request.url))
+        try:
+            with open(path + '.json') as fp:
+                meta = json.load(fp)
+            with open(path + '.body', 'rb') as fp:
+                body = fp.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.missing.add(request.url)
+            meta = {'status': 404, 'reason': 'Not Recorded', 'headers': {}}
+            body = b''
+        res = requests.Response()
+        res.status_code = meta['status']
+        res.reason = meta['reason']
+        res.headers = CaseInsensitiveDict(meta['headers'])
+        res.headers['Content-Length'] = str(len(body))
+        res.raw = io.BytesIO(body)
+        res.encoding = requests.utils.get_encoding_from_headers(res.headers)
+        res.url = request.url
+        res.request = request
+        res.connection = self
+        return res
+
+    def close(self):
+        pass
+
+
+def peak_rss(reset=False):
+    """
+    Peak RSS of this process in KiB. On Linux the peak can be reset, which
+    a new process needs since it inherits its parent's ru_maxrss.
+    """
+    try:
+        if reset:
+            with open('/proc/self/clear_refs', 'w') as fp:
+                fp.write('5')
+        with open('/proc/self/status') as fp:
+            for line in fp:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+Measurement = collections.namedtuple('Measurement', ['stage', 'wall', 'cpu', 'rss'])
+
+
+class Stages(object):
+    """
+    Wall time, CPU time (of every thread) and peak RSS growth of each
+    stage of a run, in the order they were measured.
+    """
+
+    def __init__(self):
+        self.measurements = []
+
+    @contextlib.contextmanager
+    def measure(self, stage):
+        base_rss = peak_rss(reset=True)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self.measurements.append(Measurement(
+                stage,
+                time.perf_counter() - wall,
+                time.process_time() - cpu,
+                peak_rss() - base_rss,
+            ))
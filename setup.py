@@ -18,6 +18,9 @@ setup(
     description=description,
     packages=['unbiased', 'unbiased.sources'],
     package_data={
+        'unbiased.sources': [
+            'defs/*.json',
+        ],
         'unbiased': [
             'html_template/*.html',
             'html_template/*.css',
@@ -32,6 +35,11 @@ setup(
         'lxml',
         'beautifulsoup4',
     ],
+    extras_require={
+        'brotli': ['brotli'],
+        'css': ['cssselect'],
+        'yaml': ['PyYAML'],
+    },
     entry_points={
         'console_scripts': [
             'unbiased = unbiased.main:main',
@@ -0,0 +1,269 @@
+import array
+import collections
+import hashlib
+import json
+import logging
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from unbiased import codec
+
+logger = logging.getLogger('unbiased')
+
+
+class HTTPCache(object):
+    """
+    On-disk cache of response bodies and their validators, for conditional
+    GETs. Every entry is a single file named by the hash of its url,
+    holding one line of JSON metadata followed by the raw body.
+    """
+
+    # response headers kept alongside the body
+    kept_headers = ['content-type', 'etag', 'last-modified', 'cache-control']
+
+    _max_age_pat = re.compile(r'(?:^|,)\s*max-age\s*=\s*"?(\d+)"?', re.I)
+
+    def __init__(self, directory, max_size=256 * 1024 * 1024, max_age=7 * 24 * 60 * 60):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        self._prune_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url.encode('utf8')).hexdigest())
+
+    def lookup(self, url):
+        """
+        Return the cached entry for 'url' as (meta, body), or None.
+        """
+        path = self._path(url)
+        try:
+            with open(path, 'rb') as fp:
+                meta = json.loads(fp.readline().decode('utf8'))
+                body = fp.read()
+        except (OSError, ValueError):
+            return None
+        if meta.get('url') != url:
+            return None
+        # the file's mtime is used as the last access time for eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return meta, body
+
+    def store(self, url, headers, body, truncated=False):
+        """
+        Cache a 200 response, if it has anything that lets us reuse it.
+        """
+        headers = {k: headers[k] for k in self.kept_headers if k in headers}
+        cache_control = headers.get('cache-control', '').lower()
+        if 'no-store' in cache_control or 'private' in cache_control:
+            return
+        expires = self._expires(cache_control)
+        if expires is None and 'etag' not in headers and 'last-modified' not in headers:
+            return
+        meta = {
+            'url': url,
+            'headers': headers,
+            'expires': expires,
+            'truncated': truncated,
+        }
+        self._write(self._path(url), meta, body)
+
+    def refresh(self, url, meta, body, headers):
+        """
+        Update an entry after the server answered 304 Not Modified.
+        """
+        for k in self.kept_headers:
+            if k in headers:
+                meta['headers'][k] = headers[k]
+        meta['expires'] = self._expires(meta['headers'].get('cache-control', '').lower())
+        self._write(self._path(url), meta, body)
+
+    @staticmethod
+    def is_fresh(meta):
+        return meta.get('expires') is not None and meta['expires'] > time.time()
+
+    @staticmethod
+    def validators(meta):
+        """
+        Return the request headers that make a GET conditional on 'meta'.
+        """
+        headers = {}
+        if 'etag' in meta['headers']:
+            headers['If-None-Match'] = meta['headers']['etag']
+        if 'last-modified' in meta['headers']:
+            headers['If-Modified-Since'] = meta['headers']['last-modified']
+        return headers
+
+    def _expires(self, cache_control):
+        if 'no-cache' in cache_control:
+            return None
+        match = self._max_age_pat.search(cache_control)
+        if match is None:
+            return None
+        return time.time() + int(match.group(1))
+
+    def _write(self, path, meta, body):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(json.dumps(meta).encode('utf8'))
+                fp.write(b'\n')
+                fp.write(body)
+            os.replace(tmp_path, path)
+        except OSError as ex:
+            logger.debug('Failed to write cache entry: path={} ex={}'.format(path, ex))
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def prune(self):
+        """
+        Evict entries that haven't been used in 'max_age' seconds, then
+        the least recently used ones until the cache fits in 'max_size'.
+        """
+        with self._prune_lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+            entries.sort(reverse=True)
+            oldest = time.time() - self.max_age
+            total = 0
+            removed = 0
+            for mtime, size, path in entries:
+                total += size
+                if mtime < oldest or total > self.max_size:
+                    try:
+                        os.remove(path)
+                        removed += 1
+                    except OSError:
+                        pass
+            logger.debug('Pruned {} of {} http cache entries'.format(removed, len(entries)))
+
+
+class ArticleCache(object):
+    """
+    Parsed articles, keyed by url and the hash of the page they were parsed
+    from, so an unchanged page never has to be parsed twice. Entries expire
+    after 'ttl' seconds and the least recently used ones are dropped once
+    there are more than 'max_entries'. The cache is kept in memory and
+    written to 'path' by save().
+    """
+
+    # the file is this header, the digest and time of every entry, and
+    # then the articles, in unbiased.codec's format
+    _header = struct.Struct('<4sBI')
+    _magic = b'UBAC'
+    _version = 1
+    _digest_size = hashlib.sha1().digest_size
+
+    def __init__(self, path, max_entries=5000, ttl=2 * 24 * 60 * 60):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def digest(content):
+        return hashlib.sha1(content).digest()
+
+    def lookup(self, url, digest):
+        """
+        Return the cached Article, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None or entry[0] != digest or entry[1] + self.ttl < time.time():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(url)
+            self.hits += 1
+            return entry[2]
+
+    def store(self, url, digest, article):
+        with self._lock:
+            self._entries[url] = (digest, time.time(), article)
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as fp:
+                data = fp.read()
+        except OSError:
+            return
+        try:
+            magic, version, count = self._header.unpack_from(data, 0)
+            if magic != self._magic or version != self._version:
+                raise codec.CodecError('Unknown article cache format')
+            offset = self._header.size
+            digests = [data[offset + i * self._digest_size:offset + (i + 1) * self._digest_size] for i in range(count)]
+            offset += count * self._digest_size
+            stored = array.array('d')
+            stored.frombytes(data[offset:offset + count * stored.itemsize])
+            if sys.byteorder == 'big':
+                stored.byteswap()
+            offset += count * stored.itemsize
+            articles, = codec.decode(data[offset:])
+            if len(articles) != count:
+                raise codec.CodecError('Wrong number of articles')
+        except (struct.error, ValueError) as ex:
+            logger.warning('Bad article cache: path={} ex={}'.format(self.path, ex))
+            return
+        oldest = time.time() - self.ttl
+        for digest, when, article in zip(digests, stored, articles):
+            if when >= oldest:
+                self._entries[article.url] = (digest, when, article)
+        logger.debug('Loaded {} cached articles'.format(len(self._entries)))
+
+    def save(self):
+        """
+        Drop expired entries and write the rest to disk.
+        """
+        with self._lock:
+            oldest = time.time() - self.ttl
+            for url in [k for k, v in self._entries.items() if v[1] < oldest]:
+                del self._entries[url]
+            entries = list(self._entries.values())
+            logger.debug('Article cache: {} entries, {} hits, {} misses'.format(len(entries), self.hits, self.misses))
+            self.hits = 0
+            self.misses = 0
+        stored = array.array('d', (x[1] for x in entries))
+        if sys.byteorder == 'big':
+            stored.byteswap()
+        data = b''.join([
+            self._header.pack(self._magic, self._version, len(entries)),
+            b''.join(x[0] for x in entries),
+            stored.tobytes(),
+            codec.encode([[x[2] for x in entries]]),
+        ])
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+            os.replace(tmp_path, self.path)
+        except OSError as ex:
+            logger.warning('Failed to save article cache: ex={}'.format(ex))
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
@@ -0,0 +1,113 @@
+import collections
+import hashlib
+import logging
+import re
+import struct
+import threading
+
+logger = logging.getLogger('unbiased')
+
+# a MinHash signature is 'bands' * 'rows' values. two stories land in
+# the same LSH bucket, and are compared, if all the values of any one
+# band agree; that gets likely once their Jaccard similarity passes
+# about (1 / bands) ** (1 / rows). compared stories are clustered
+# together if their signatures agree on at least 'threshold' of values.
+bands = 32
+rows = 2
+threshold = 0.3
+
+_signature_size = bands * rows
+_unpack = struct.Struct('<{}I'.format(_signature_size)).unpack
+
+_word_pat = re.compile(r'\w+')
+_stopwords = frozenset('''
+    a about after all also an and are as at be been but by can could did
+    do does for from had has have he her his how in into is it its more
+    new not of on or our out over says said she so than that the their
+    them they this to up was we were what when which who why will with
+    would you your
+'''.split())
+
+# signatures by text, since the same stories are clustered every time
+# the page is rendered
+_signatures = collections.OrderedDict()
+_signatures_lock = threading.Lock()
+max_signatures = 20000
+
+
+def shingles(text):
+    """
+    The words of 'text' that say something about what it's about.
+    """
+    return set(x for x in _word_pat.findall(text.lower()) if x not in _stopwords and len(x) > 1)
+
+
+def signature(text):
+    """
+    The MinHash signature of 'text', or None if it has no shingles.
+    """
+    with _signatures_lock:
+        if text in _signatures:
+            _signatures.move_to_end(text)
+            return _signatures[text]
+    words = shingles(text)
+    if not words:
+        sig = None
+    else:
+        # every shingle gets all of its hash values from one call, and
+        # the per-position minimums are taken in C by zip() and min()
+        hashes = [_unpack(hashlib.shake_128(x.encode('utf8')).digest(_signature_size * 4)) for x in words]
+        sig = tuple(map(min, zip(*hashes)))
+    with _signatures_lock:
+        _signatures[text] = sig
+        while len(_signatures) > max_signatures:
+            _signatures.popitem(last=False)
+    return sig
+
+
+def similarity(sig1, sig2):
+    """
+    The Jaccard similarity of two texts, estimated from their signatures.
+    """
+    return sum(1 for x, y in zip(sig1, sig2) if x == y) / _signature_size
+
+
+def _story_text(story):
+    return '{} {}'.format(story.title or '', story.description or '')
+
+
+def cluster_stories(stories):
+    """
+    Group stories about the same thing, by the words of their titles and
+    descriptions. Returns {story: cluster number}; stories that aren't
+    like any other get a cluster of their own. Only stories that share
+    an LSH bucket are ever compared, so this stays close to linear in
+    the number of stories.
+    """
+    stories = list(stories)
+    sigs = [signature(_story_text(x)) for x in stories]
+    parents = list(range(len(stories)))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    buckets = {}
+    for i, sig in enumerate(sigs):
+        if sig is None:
+            continue
+        for band in range(bands):
+            key = (band, sig[band * rows:(band + 1) * rows])
+            bucket = buckets.setdefault(key, [])
+            for j in bucket:
+                if find(i) != find(j) and similarity(sig, sigs[j]) >= threshold:
+                    parents[find(i)] = find(j)
+            bucket.append(i)
+
+    clusters = {}
+    for i, story in enumerate(stories):
+        clusters[story] = find(i)
+    logger.debug('Clustered {} stories into {} clusters'.format(len(stories), len(set(clusters.values()))))
+    return clusters
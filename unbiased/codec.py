@@ -0,0 +1,103 @@
+import array
+import itertools
+import struct
+import sys
+
+from unbiased.sources.base import Article
+
+# groups of articles (e.g. the tiers of a source) are stored as one string
+# of every field, so decoding is one utf8 decode and one split:
+#
+#   magic, version                   4s B
+#   number of groups, their sizes    I, I * groups
+#   number of None fields, indexes   I, I * nones
+#   every field of every article     utf8, separated by NUL
+#
+# 'image' is derived data and isn't stored. NUL can't be in html text, so
+# any in a field are replaced the way html parsers do. all numbers are
+# little-endian.
+MAGIC = b'UBAR'
+VERSION = 2
+
+FIELDS = ['source', 'title', 'author', 'description', 'url', 'img']
+SEPARATOR = '\x00'
+
+_header = struct.Struct('<4sB')
+_count = struct.Struct('<I')
+
+
+class CodecError(ValueError):
+    pass
+
+
+def _to_bytes(values):
+    arr = array.array('I', values)
+    if arr.itemsize != 4:
+        raise CodecError('No 4-byte array type')
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    return _count.pack(len(arr)) + arr.tobytes()
+
+
+def _from_bytes(data, offset):
+    count, = _count.unpack_from(data, offset)
+    offset += _count.size
+    end = offset + count * 4
+    if end > len(data):
+        raise CodecError('Truncated data')
+    arr = array.array('I', data[offset:end])
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    return arr, end
+
+
+def encode(groups):
+    """
+    Encode a sequence of groups of Articles into bytes.
+    """
+    groups = [tuple(x) for x in groups]
+    values = [x for group in groups for article in group for x in article[:len(FIELDS)]]
+    nones = [i for i, x in enumerate(values) if x is None]
+    text = SEPARATOR.join(['' if x is None else x for x in values])
+    if text.count(SEPARATOR) != max(0, len(values) - 1):
+        text = SEPARATOR.join(['' if x is None else x.replace(SEPARATOR, '\ufffd') for x in values])
+    return b''.join([
+        _header.pack(MAGIC, VERSION),
+        _to_bytes(len(x) for x in groups),
+        _to_bytes(nones),
+        text.encode('utf8'),
+    ])
+
+
+def decode(data):
+    """
+    Decode bytes made by encode() back into a tuple of tuples of Articles.
+    """
+    try:
+        magic, version = _header.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise CodecError('Not encoded articles')
+        if version != VERSION:
+            raise CodecError('Unknown version: {}'.format(version))
+        group_sizes, offset = _from_bytes(data, _header.size)
+        nones, offset = _from_bytes(data, offset)
+        article_count = sum(group_sizes)
+        values = str(data[offset:], 'utf8').split(SEPARATOR) if offset < len(data) else []
+        if len(values) != article_count * len(FIELDS):
+            raise CodecError('Wrong number of fields')
+        values[0::len(FIELDS)] = list(map(sys.intern, values[0::len(FIELDS)]))
+        for i in nones:
+            values[i] = None
+    except (struct.error, UnicodeDecodeError, IndexError) as ex:
+        raise CodecError(str(ex))
+    # straight to tuple.__new__, as the sources are already interned
+    width = len(FIELDS)
+    columns = [values[i::width] for i in range(width)]
+    columns.append(itertools.repeat(None, article_count))
+    articles = list(map(tuple.__new__, itertools.repeat(Article, article_count), zip(*columns)))
+    ret = []
+    start = 0
+    for size in group_sizes:
+        ret.append(tuple(articles[start:start + size]))
+        start += size
+    return tuple(ret)
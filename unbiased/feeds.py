@@ -0,0 +1,128 @@
+import collections
+import io
+import re
+
+import lxml.etree
+import lxml.html
+
+ATOM_NS = 'http://www.w3.org/2005/Atom'
+RSS1_NS = 'http://purl.org/rss/1.0/'
+MEDIA_NS = 'http://search.yahoo.com/mrss/'
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+IMAGE_SITEMAP_NS = 'http://www.google.com/schemas/sitemap-image/1.1'
+
+# the elements that hold one story, in RSS 2.0, RSS 1.0, Atom and
+# (news) sitemaps
+ITEM_TAGS = [
+    (None, 'item'),
+    (RSS1_NS, 'item'),
+    (ATOM_NS, 'entry'),
+    (SITEMAP_NS, 'url'),
+]
+
+# elements that break up the words around them, and links at the end of
+# descriptions that only point to the story
+BLOCK_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'figcaption', 'figure', 'footer',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'ol', 'p', 'pre', 'section', 'table', 'td', 'th', 'tr', 'ul',
+}
+_read_more_pat = re.compile(r'^(continue reading|read more|read the (full|rest)|full story|keep reading)\b', re.I)
+
+FeedItem = collections.namedtuple('FeedItem', ['url', 'title', 'author', 'description', 'img'])
+
+
+def _html_text(text):
+    # descriptions are often html, which only the words of are wanted
+    if '<' in text or '&' in text:
+        root = lxml.html.fragment_fromstring(text, create_parent='div')
+        links = root.findall('.//a')
+        while links:
+            link = links[-1].text_content().strip()
+            if not (_read_more_pat.match(link) and root.text_content().rstrip().endswith(link)):
+                break
+            links.pop().drop_tree()
+        for el in root.iterdescendants():
+            if el.tag in BLOCK_TAGS:
+                el.text = ' ' + (el.text or '')
+                el.tail = ' ' + (el.tail or '')
+        text = root.text_content()
+    return ' '.join(text.split())
+
+
+def _author(text):
+    # rss authors are meant to be "email (Name)"
+    if '(' in text and text.endswith(')'):
+        return text[text.index('(') + 1:-1].strip()
+    return text
+
+
+def _pick_image(images, image_width):
+    # the smallest one that's still big enough, or the biggest
+    sized = sorted(x for x in images if x[0])
+    for width, src in sized:
+        if width >= image_width:
+            return src
+    if sized:
+        return sized[-1][1]
+    return images[0][1] if images else None
+
+
+def _parse_item(item, image_width):
+    url = title = author = description = None
+    images = []
+    for el in item.iter():
+        if el is item or not isinstance(el.tag, str):
+            continue
+        qname = lxml.etree.QName(el)
+        ns, name = qname.namespace, qname.localname
+        text = (el.text or '').strip()
+        if name == 'link' and url is None:
+            if el.get('href'):
+                if el.get('rel', 'alternate') == 'alternate':
+                    url = el.get('href')
+            elif text:
+                url = text
+        elif name == 'loc' and ns == SITEMAP_NS and url is None:
+            url = text
+        elif name == 'title' and ns not in [MEDIA_NS, IMAGE_SITEMAP_NS] and title is None:
+            # atom titles can be escaped html, or xhtml elements
+            if el.get('type') == 'html':
+                text = _html_text(text)
+            elif el.get('type') == 'xhtml':
+                text = ' '.join(''.join(el.itertext()).split())
+            title = text or None
+        elif name in ['description', 'summary'] and ns != MEDIA_NS and description is None:
+            description = _html_text(text) or None
+        elif (name == 'creator' or name == 'author' or (name == 'name' and lxml.etree.QName(el.getparent()).localname == 'author')) and author is None:
+            author = _author(text) or None
+        elif name in ['content', 'thumbnail'] and ns == MEDIA_NS and el.get('url'):
+            if el.get('medium', 'image') == 'image' and el.get('type', 'image/').startswith('image/'):
+                images.append((int(el.get('width') or 0), el.get('url')))
+        elif name == 'enclosure' and el.get('type', '').startswith('image/') and el.get('url'):
+            images.append((0, el.get('url')))
+        elif name == 'loc' and ns == IMAGE_SITEMAP_NS and text:
+            images.append((0, text))
+    if not url:
+        return None
+    return FeedItem(url, title, author, description, _pick_image(images, image_width))
+
+
+def parse_feed(content, image_width=700):
+    """
+    Return a FeedItem for every story in an RSS, Atom or sitemap document,
+    in order. The document is parsed as a stream, one story at a time, and
+    missing fields are None. For stories with several sizes of image, the
+    smallest one at least 'image_width' wide is picked.
+    """
+    items = []
+    tags = set('{{{}}}{}'.format(ns, name) if ns else name for ns, name in ITEM_TAGS)
+    events = lxml.etree.iterparse(io.BytesIO(content), events=('end',), tag=tags, recover=True, resolve_entities=False)
+    for _, el in events:
+        item = _parse_item(el, image_width)
+        if item is not None:
+            items.append(item)
+        # throw away what's been read, so memory use stays flat
+        el.clear()
+        while el.getprevious() is not None:
+            del el.getparent()[0]
+    return items
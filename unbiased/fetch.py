@@ -0,0 +1,395 @@
+import codecs
+import contextlib
+import logging
+import re
+import threading
+import time
+import urllib
+
+import requests
+from urllib3.util.retry import Retry
+
+from unbiased import politeness, resilience
+from unbiased.metrics import registry as metrics
+
+logger = logging.getLogger('unbiased')
+
+# maximum number of requests in flight, overall and against a single host
+max_requests = 8
+max_requests_per_host = 4
+
+# connections kept alive per host, and how transient failures are retried
+pool_size = 4
+retries = 2
+retry_backoff = 0.3
+# 429s and 503s are left to unbiased.politeness, which backs off the
+# whole host rather than retrying the one request
+retry_statuses = (502, 504)
+
+_global_limit = threading.BoundedSemaphore(max_requests)
+_host_limits = {}
+_host_limits_lock = threading.Lock()
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# largest response body read, by the main type of its Content-Type
+max_body_sizes = {
+    'text': 4 * 1024 * 1024,
+    'image': 16 * 1024 * 1024,
+}
+default_max_body_size = 4 * 1024 * 1024
+chunk_size = 64 * 1024
+
+# how much of a body 'check_head' gets to see before the download is
+# given up on, so something it can't make sense of isn't read to the end
+max_head_check_size = 256 * 1024
+
+# the most of a body left unread after 'stop_at' that is read anyway, so
+# the connection can be kept alive
+max_drain_size = 256 * 1024
+
+_charset_pat = re.compile(r';\s*charset\s*=\s*["\']?([\w.:-]+)', re.I)
+
+# <meta charset> and <meta http-equiv="Content-Type">, looked for in the
+# start of html documents without a charset in their headers
+_meta_charset_pat = re.compile(br'<meta[^>]+charset\s*=\s*["\']?([\w.:-]+)', re.I)
+meta_charset_scan_size = 4096
+
+# an optional unbiased.cache.HTTPCache
+_cache = None
+
+# an optional requests transport adapter to send every request through,
+# in place of the pooled HTTPAdapters (e.g. to replay recorded responses)
+_transport = None
+
+
+class DownloadError(Exception):
+    pass
+
+
+class DownloadAborted(DownloadError):
+    pass
+
+
+class Throttled(DownloadError):
+    pass
+
+
+class RobotsDisallowed(Exception):
+    pass
+
+
+# errors that might go away if the request is tried again later
+TRANSIENT_ERRORS = (requests.RequestException, DownloadError)
+
+
+class Response(object):
+    """
+    A downloaded response. Bodies served from the cache look just like
+    ones that came from the network. 'truncated' is set if the download
+    was stopped early on purpose.
+    """
+
+    def __init__(self, url, status_code, headers, content, from_cache=False, truncated=False):
+        self.url = url
+        self.status_code = status_code
+        self.headers = requests.structures.CaseInsensitiveDict(headers)
+        self.content = content
+        self.from_cache = from_cache
+        self.truncated = truncated
+        self._encoding = False
+
+    @property
+    def encoding(self):
+        """
+        The charset of the body, from a byte order mark, the Content-Type
+        header or a <meta> tag near the start of the document, in that
+        order, or None if none of them give a known one. The body is never
+        sniffed any further than that.
+        """
+        if self._encoding is False:
+            self._encoding = _detect_encoding(self.headers, self.content)
+        return self._encoding
+
+
+def _known_encoding(name):
+    # the label is kept as it was given, as the parsers don't all know
+    # Python's own names for charsets (e.g. euc_jp for EUC-JP)
+    try:
+        codecs.lookup(name)
+    except LookupError:
+        return None
+    return name
+
+
+def _detect_encoding(headers, content):
+    if content.startswith(codecs.BOM_UTF8):
+        return 'utf-8'
+    if content.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    match = _charset_pat.search(headers.get('content-type', ''))
+    if match is not None:
+        encoding = _known_encoding(match.group(1))
+        if encoding is not None:
+            return encoding
+    match = _meta_charset_pat.search(content, 0, meta_charset_scan_size)
+    if match is not None:
+        return _known_encoding(match.group(1).decode('ascii'))
+    return None
+
+
+def configure(concurrency=None, per_host=None, pool=None, retry=None, cache=None, max_sizes=None, transport=None):
+    """
+    Set the request limits, connection pool options, http cache and
+    transport. Must be called before any crawling starts.
+    """
+    global max_requests, max_requests_per_host, pool_size, retries, _global_limit, _cache, _transport
+    if concurrency is not None:
+        max_requests = max(1, concurrency)
+        _global_limit = threading.BoundedSemaphore(max_requests)
+    if per_host is not None:
+        max_requests_per_host = max(1, per_host)
+    if pool is not None:
+        pool_size = max(1, pool)
+    if retry is not None:
+        retries = max(0, retry)
+    if cache is not None:
+        _cache = cache
+    if max_sizes is not None:
+        max_body_sizes.update(max_sizes)
+    if transport is not None:
+        _transport = transport
+    with _host_limits_lock:
+        _host_limits.clear()
+    close()
+
+
+def close():
+    """
+    Close all of the pooled connections.
+    """
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def _new_session():
+    if _transport is not None:
+        session = requests.Session()
+        session.headers['User-Agent'] = politeness.user_agent
+        session.mount('http://', _transport)
+        session.mount('https://', _transport)
+        return session
+    retry = Retry(
+        total=retries,
+        backoff_factor=retry_backoff,
+        status_forcelist=retry_statuses,
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    )
+    # every session only talks to a single host, so it only needs one
+    # pool, but that pool should be as big as the host's request limit
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=max(pool_size, max_requests_per_host),
+        max_retries=retry,
+    )
+    # robots.txt is obeyed for this user agent, so it's the one to send
+    session = requests.Session()
+    session.headers['User-Agent'] = politeness.user_agent
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def session_for(url):
+    """
+    Return the keep-alive session for the host of 'url'. Sessions live
+    until close() is called, so connections are reused across crawls.
+    """
+    parts = urllib.parse.urlparse(url)
+    key = (parts.scheme, parts.netloc)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _new_session()
+            _sessions[key] = session
+        return session
+
+
+def _host_limit(host):
+    with _host_limits_lock:
+        limit = _host_limits.get(host)
+        if limit is None:
+            limit = threading.BoundedSemaphore(min(max_requests, max_requests_per_host))
+            _host_limits[host] = limit
+        return limit
+
+
+@contextlib.contextmanager
+def limit(url):
+    """
+    Hold a request slot for the host of 'url' and one of the global slots.
+    The host slot is taken first so that requests queued up behind a busy
+    host don't starve requests to other hosts.
+    """
+    host = urllib.parse.urlparse(url).netloc
+    with _host_limit(host):
+        with _global_limit:
+            yield
+
+
+def prune_cache():
+    if _cache is not None:
+        _cache.prune()
+
+
+def max_body_size(headers):
+    content_type = headers.get('content-type', '').split('/', 1)[0].strip().lower()
+    return max_body_sizes.get(content_type, default_max_body_size)
+
+
+def _load_robots(url):
+    host = urllib.parse.urlparse(url).netloc
+    session = session_for(url)
+    with limit(url):
+        with contextlib.closing(session.get(url, timeout=resilience.timeout_for(host), stream=True)) as res:
+            if res.status_code != 200:
+                _drain(res)
+                return res.status_code, b''
+            body, _ = _read_body(res)
+    return res.status_code, body
+
+
+def _drain(res, chunks=None):
+    # a response closed before all of its body is read takes its
+    # connection down with it, so when there isn't much left it's cheaper
+    # to read it and throw it away than to connect again for the next one.
+    # that goes for the bodies of 304s and errors, which aren't wanted.
+    length = res.headers.get('content-length')
+    tell = getattr(res.raw, 'tell', None)
+    if length is not None and length.isdigit() and tell is not None and int(length) - tell() > max_drain_size:
+        return
+    if chunks is None:
+        chunks = res.iter_content(chunk_size)
+    drained = 0
+    try:
+        for chunk in chunks:
+            drained += len(chunk)
+            if drained > max_drain_size:
+                return
+    except requests.RequestException:
+        pass
+
+
+def _read_body(res, stop_at=None, check_head=None):
+    """
+    Stream the body of 'res', giving up if it gets bigger than allowed for
+    its content type. Reading stops early once 'stop_at' has been seen,
+    and each time more data comes in 'check_head' is called with all of
+    it so far, until it returns True; if it hasn't by the time
+    'max_head_check_size' bytes are in, the download is aborted. Returns
+    (body, truncated).
+    """
+    limit = max_body_size(res.headers)
+    length = res.headers.get('content-length')
+    if length is not None and length.isdigit() and int(length) > limit:
+        raise DownloadAborted('Body too large: url={} length={}'.format(res.url, length))
+    body = bytearray()
+    chunks = res.iter_content(chunk_size)
+    for chunk in chunks:
+        start = max(0, len(body) - len(stop_at or b''))
+        body.extend(chunk)
+        if len(body) > limit:
+            raise DownloadAborted('Body too large: url={} length>{}'.format(res.url, limit))
+        if check_head is not None:
+            if check_head(bytes(body)):
+                check_head = None
+            elif len(body) >= max_head_check_size:
+                raise DownloadAborted('Unrecognized head: url={} length>={}'.format(res.url, max_head_check_size))
+        if stop_at is not None and body[start:].lower().find(stop_at) != -1:
+            _drain(res, chunks)
+            return bytes(body), True
+    return bytes(body), False
+
+
+def get(url, timeout=None, stop_at=None, check_head=None):
+    """
+    GET 'url', going through the http cache if there is one. Fresh cached
+    entries are returned without touching the network, and stale ones are
+    revalidated with a conditional request. The body is streamed, see
+    _read_body() for 'stop_at' and 'check_head'. Unless 'timeout' is
+    given, it adapts to how fast the host has been lately. Requests wait
+    their turn at the host, see unbiased.politeness, and raise Throttled
+    if that would take too long or RobotsDisallowed if robots.txt says no.
+    """
+    start = time.time()
+    try:
+        res = _get(url, timeout, stop_at, check_head)
+    except Exception:
+        metrics.record_fetch(url, 'error', time.time() - start, 0, False)
+        raise
+    metrics.record_fetch(url, res.status_code, time.time() - start, len(res.content), res.from_cache)
+    return res
+
+
+def _get(url, timeout, stop_at, check_head):
+    entry = None
+    headers = {}
+    if _cache is not None:
+        entry = _cache.lookup(url)
+        # a body cut short can't stand in for the whole thing
+        if entry is not None and entry[0].get('truncated') and stop_at is None:
+            entry = None
+        if entry is not None:
+            meta, body = entry
+            if _cache.is_fresh(meta):
+                logger.debug('Cache hit: url={}'.format(url))
+                metrics.inc('unbiased_http_cache_total', result='fresh')
+                return Response(url, 200, meta['headers'], body, from_cache=True, truncated=meta.get('truncated', False))
+            headers = _cache.validators(meta)
+
+    host = urllib.parse.urlparse(url).netloc
+    if not politeness.allowed(url, _load_robots):
+        metrics.inc('unbiased_politeness_total', host=host, result='disallowed')
+        raise RobotsDisallowed('Disallowed by robots.txt: url={}'.format(url))
+    if timeout is None:
+        timeout = resilience.timeout_for(host)
+    session = session_for(url)
+    # a host that throttles us gets one more try, once it says it's ready
+    for attempt in range(2):
+        if politeness.wait(url) is None:
+            raise Throttled('Host is throttling: url={}'.format(url))
+        with limit(url):
+            start = time.time()
+            try:
+                res = session.get(url, timeout=timeout, headers=headers, stream=True)
+            except (requests.Timeout, requests.ConnectionError):
+                # counted as taking the whole timeout, or a host that slows
+                # down would never get any more time than it has now
+                resilience.host_latency.record(host, timeout)
+                raise
+            with contextlib.closing(res):
+                resilience.host_latency.record(host, time.time() - start)
+                if res.status_code != 200:
+                    _drain(res)
+                if politeness.record(url, res.status_code, res.headers) is not None and attempt == 0:
+                    continue
+                if res.status_code == 304 and entry is not None:
+                    logger.debug('Cache revalidated: url={}'.format(url))
+                    metrics.inc('unbiased_http_cache_total', result='revalidated')
+                    meta, body = entry
+                    _cache.refresh(url, meta, body, res.headers)
+                    return Response(url, 200, meta['headers'], body, from_cache=True, truncated=meta.get('truncated', False))
+                if res.status_code != 200:
+                    return Response(url, res.status_code, res.headers, b'')
+                body, truncated = _read_body(res, stop_at, check_head)
+        break
+
+    response = Response(url, res.status_code, res.headers, body, truncated=truncated)
+    if _cache is not None:
+        metrics.inc('unbiased_http_cache_total', result='miss')
+        _cache.store(url, res.headers, body, truncated)
+    return response
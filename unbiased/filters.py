@@ -0,0 +1,143 @@
+import json
+import logging
+import re
+import threading
+
+logger = logging.getLogger('unbiased')
+
+# the article fields that can be blocked, by the name of their 'bad_'
+# variable on NewsSource and their key in blocklist files
+FIELDS = [
+    ('titles', 'title'),
+    ('descriptions', 'description'),
+    ('authors', 'author'),
+    ('imgs', 'img'),
+    ('urls', 'url'),
+]
+
+# terms starting with this are regular expressions, the rest are plain
+# strings that block an article if they appear anywhere in the field
+REGEX_PREFIX = 're:'
+
+# terms from blocklist files, {source shortname or '*': {field: [terms]}}
+_extra_terms = {}
+
+# compiled blocklists, by source
+_blocklists = {}
+_blocklists_lock = threading.Lock()
+
+
+def _trie_pattern(words):
+    """
+    A regex matching any of 'words', with common prefixes factored out,
+    so it doesn't have to try every word in turn at every position.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def pattern(node):
+        if list(node) == ['']:
+            return ''
+        optional = '' in node
+        branches = sorted(re.escape(char) + pattern(child) for char, child in node.items() if char)
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        ret = '(?:{})'.format('|'.join(branches))
+        return ret + '?' if optional else ret
+
+    return pattern(trie)
+
+
+def compile_terms(terms):
+    """
+    Compile a list of plain string and 're:' terms into one regex, or
+    return None if there aren't any.
+    """
+    words = []
+    patterns = []
+    for term in terms or ():
+        if term.startswith(REGEX_PREFIX):
+            # compiled separately first, so a bad one is blamed on itself
+            patterns.append(re.compile(term[len(REGEX_PREFIX):]).pattern)
+        elif term:
+            words.append(term)
+    if words:
+        patterns.insert(0, _trie_pattern(words))
+    if not patterns:
+        return None
+    return re.compile('|'.join('(?:{})'.format(x) for x in patterns))
+
+
+class Blocklist(object):
+    """
+    Every blocked term of a source, compiled into one regex per field so
+    an article is checked in a single pass however many terms there are.
+    'terms' is {field: [terms]}, with the field names of FIELDS.
+    """
+
+    def __init__(self, terms):
+        self._patterns = []
+        for key, field in FIELDS:
+            pattern = compile_terms(terms.get(key))
+            if pattern is not None:
+                self._patterns.append((field, pattern))
+
+    def match(self, article):
+        """
+        Return the name of the first field of 'article' that contains a
+        blocked term, or None if there isn't one.
+        """
+        for field, pattern in self._patterns:
+            value = getattr(article, field)
+            if value and pattern.search(value):
+                return field
+        return None
+
+
+def load_blocklists(path):
+    """
+    Add the terms in the JSON file at 'path' to the blocklists of the
+    sources. The file maps source short names, or '*' for every source,
+    to {field: [terms]}, e.g.
+
+        {"fox": {"authors": ["Sean Hannity"], "urls": ["re:/opinion/"]}}
+    """
+    with open(path) as fp:
+        config = json.load(fp)
+    keys = set(x for x, _ in FIELDS)
+    extra = {}
+    for shortname, terms in config.items():
+        unknown = set(terms) - keys
+        if unknown:
+            raise ValueError('Unknown blocklist fields for {}: {}'.format(shortname, sorted(unknown)))
+        for key, values in terms.items():
+            # checked now rather than on the first crawl
+            compile_terms(values)
+            extra.setdefault(shortname.lower(), {})[key] = list(values)
+    with _blocklists_lock:
+        _extra_terms.clear()
+        _extra_terms.update(extra)
+        _blocklists.clear()
+    logger.info('Loaded blocklists for: {}'.format(sorted(extra)))
+
+
+def blocklist_for(source):
+    """
+    The compiled Blocklist of 'source', from its 'bad_' variables and any
+    loaded blocklist files. Built once per source.
+    """
+    with _blocklists_lock:
+        blocklist = _blocklists.get(source)
+        if blocklist is None:
+            terms = {}
+            for key, _ in FIELDS:
+                terms[key] = list(getattr(source, 'bad_' + key) or [])
+                for name in ['*', source.shortname.lower()]:
+                    terms[key].extend(_extra_terms.get(name, {}).get(key, []))
+            blocklist = Blocklist(terms)
+            _blocklists[source] = blocklist
+        return blocklist
@@ -1,14 +1,27 @@
 #!/usr/bin/env python3
 
 import argparse
+import concurrent.futures
 import io
 import logging
 import logging.config
+import multiprocessing
 import os
+import sys
+import threading
 import time
+from concurrent.futures.process import BrokenProcessPool
 
-from unbiased.util import pickStories, pullImage, buildOutput, write_files, write_static_files
-from unbiased.sources import get_sources
+from unbiased import fetch, politeness, resilience
+from unbiased.metrics import registry as metrics
+from unbiased.cache import ArticleCache, HTTPCache
+from unbiased.filters import load_blocklists
+from unbiased.sources.base import NewsSource
+from unbiased.publish import Publisher
+from unbiased.scheduler import Scheduler
+from unbiased.snapshots import SnapshotStore, default_max_age as default_snapshot_age
+from unbiased.util import pickStories, pullImage, transcode_image, buildOutput, setup_templates, seed_picker
+from unbiased.sources import get_sources, registry as source_registry
 
 logger = logging.getLogger('unbiased')
 
@@ -60,6 +73,17 @@ def main():
     parser.add_argument('-d', '--debug', action='store_true', help='run in debug mode')
     parser.add_argument('-o', '--oneshot', action='store_true', help='run once and exit')
     parser.add_argument('-s', '--sources', type=lambda x: x.split(','), default=None)
+    parser.add_argument('-c', '--concurrency', type=int, default=fetch.max_requests, help='maximum number of simultaneous requests')
+    parser.add_argument('--pool-size', type=int, default=fetch.pool_size, help='keep-alive connections per host')
+    parser.add_argument('--retries', type=int, default=fetch.retries, help='retries for failed requests')
+    parser.add_argument('--host-rate', type=float, default=politeness.default_rate, help='requests per second to start each host at')
+    parser.add_argument('--ignore-robots', action='store_true', help="crawl pages even if a site's robots.txt disallows it")
+    parser.add_argument('--cache-dir', help='location to cache downloads between crawls (default: <log-dir>/cache)')
+    parser.add_argument('--source-defs', action='append', default=[], help='directory of extra source definition files, can be repeated')
+    parser.add_argument('--seed', type=int, help='seed for picking stories, to make picks repeatable')
+    parser.add_argument('--prefer-feeds', action='store_true', help='build sources from their RSS/Atom feeds where they have one')
+    parser.add_argument('--blocklist', help='JSON file of extra terms to block articles by, per source')
+    parser.add_argument('--image-workers', type=int, default=os.cpu_count(), help='processes to transcode images with, 0 to do it in-process')
     args = parser.parse_args()
 
     if args.log_dir:
@@ -73,50 +97,230 @@ def main():
     logging_config['handlers']['web']['stream'] = web_log_stream
     logging.config.dictConfig(logging_config)
 
-    crawl_frequency = 600
-    while True:
-        web_log_stream.seek(0)
-        web_log_stream.truncate()
+    NewsSource.prefer_feeds = args.prefer_feeds
+    if args.seed is not None:
+        seed_picker(args.seed)
+    for directory in args.source_defs:
+        source_registry.add_definitions(directory)
+    if args.blocklist:
+        load_blocklists(args.blocklist)
+
+    cache_dir = args.cache_dir
+    if cache_dir is None and args.log_dir:
+        cache_dir = os.path.join(args.log_dir, 'cache')
+    http_cache = None
+    snapshot_store = None
+    if cache_dir:
+        http_cache = HTTPCache(os.path.join(cache_dir, 'http'))
+        NewsSource.article_cache = ArticleCache(os.path.join(cache_dir, 'articles.cache'))
+        setup_templates(os.path.join(cache_dir, 'jinja'))
+        snapshot_store = SnapshotStore(os.path.join(cache_dir, 'snapshots.sqlite'))
+
+    fetch.configure(concurrency=args.concurrency, pool=args.pool_size, retry=args.retries, cache=http_cache)
+    politeness.configure(rate=args.host_rate, obey=not args.ignore_robots)
+
+    image_pool = None
+    if args.image_workers:
+        image_pool = ImagePool(args.image_workers)
+
+    publisher = Publisher(args.webroot)
+
+    try:
+        crawl(args, web_log_stream, image_pool, publisher, snapshot_store)
+    finally:
+        fetch.close()
+        if image_pool is not None:
+            image_pool.shutdown()
+
+
+def select_sources(source_names):
+    return list(get_sources(source_names).values())
+
+
+def crawl(args, web_log_stream, image_pool=None, publisher=None, snapshot_store=None):
+    if args.oneshot:
         logger.info('Starting crawl')
         start = time.time()
-        run(args.webroot, args.sources, web_log_stream, args.debug)
-        finish = time.time()
-        runtime = finish - start
-        sleeptime = crawl_frequency - runtime
-        logger.info('Crawl complete in {}s. Sleeping for {}s'.format(int(runtime), int(sleeptime)))
-        if args.oneshot:
-            break
-        if sleeptime > 0:
-            time.sleep(sleeptime)
+        run(args.webroot, args.sources, web_log_stream, args.debug, args.concurrency, image_pool, publisher, snapshot_store)
+        save_caches()
+        logger.info('Crawl complete in {}s'.format(int(time.time() - start)))
+        return
 
+    last_prune = time.time()
 
-def run(webroot, source_names, web_log_stream, debug_mode=False):
+    def render_page(built_sources):
+        nonlocal last_prune
+        render(args.webroot, built_sources, web_log_stream, args.concurrency, image_pool, publisher)
+        prune = time.time() - last_prune > 600
+        if prune:
+            last_prune = time.time()
+        save_caches(prune)
 
-    logger.debug('Running with webroot="{}" for sources="{}"'.format(webroot, source_names))
+    sources = select_sources(args.sources)
+    logger.info('Starting crawls for: {}'.format([x.name for x in sources]))
+    snapshots = None
+    max_age = default_snapshot_age
+    if snapshot_store is not None:
+        snapshots = snapshot_store.load_all(sources)
+        max_age = snapshot_store.max_age
+    with concurrent.futures.ThreadPoolExecutor(max(1, args.concurrency)) as article_pool:
+        scheduler = Scheduler(sources, lambda x: build_source(x, article_pool, args.debug, snapshot_store), render_page, snapshots, max_age=max_age)
+        scheduler.run_forever()
 
-    sources = get_sources()
-    if source_names is None:
-        sources = sources.values()
+
+def save_caches(prune=True):
+    if prune:
+        fetch.prune_cache()
+    if NewsSource.article_cache is not None:
+        NewsSource.article_cache.save()
+
+
+def build_source(source, pool, debug_mode=False, snapshot_store=None):
+    """
+    Build 'source', retrying with backoff if it fails in a way that might
+    fix itself. Returns None if it failed, or if its circuit breaker is
+    open because it has been failing. Good builds are saved to
+    'snapshot_store'.
+    """
+    breaker = resilience.breaker_for(source)
+    if not breaker.allow():
+        logger.info('Skipping {}, it has been failing'.format(source.name))
+        metrics.inc('unbiased_builds_total', source=source.name, result='skipped')
+        return None
+    logger.info('Crawling {}'.format(source.name))
+    tries = 0
+    while tries < 3:
+        start = time.time()
+        try:
+            built = source.build(pool)
+        except Exception as ex:
+            if debug_mode is True:
+                raise
+            tries += 1
+            # anything but a download problem means the page has changed
+            # under the scraper, and that won't be fixed by trying again
+            transient = isinstance(ex, fetch.TRANSIENT_ERRORS)
+            if tries == 3 or not transient:
+                logger.error('Build failed. source={} ex={}'.format(source.name, ex))
+                breaker.failure(permanent=not transient)
+                metrics.inc('unbiased_builds_total', source=source.name, result='failed')
+                return None
+            logger.debug('Build failed, retrying. source={} ex={}'.format(source.name, ex))
+            time.sleep(resilience.backoff(tries))
+            continue
+        metrics.observe('unbiased_build_seconds', time.time() - start, source=source.name)
+        metrics.inc('unbiased_builds_total', source=source.name, result='ok')
+        breaker.success()
+        if snapshot_store is not None:
+            snapshot_store.save(source, built)
+        return built
+    return None
+
+
+def build_sources(sources, concurrency=1, debug_mode=False, snapshot_store=None):
+    """
+    Crawl all of the sources at once. Each source gets its own thread for
+    its home page, and the article pages of every source share a pool of
+    'concurrency' workers. Built sources are returned in the order given.
+    Sources that fail are replaced by their last snapshot, if there is a
+    recent one.
+    """
+    if concurrency <= 1:
+        built_sources = [build_source(x, None, debug_mode, snapshot_store) for x in sources]
     else:
-        sources = [sources[x] for x in source_names]
-
-    built_sources = []
-    for source in sources:
-        logger.info('Crawling {}'.format(source.name))
-        tries = 0
-        while tries < 3:
-            time.sleep(tries)
+        with concurrent.futures.ThreadPoolExecutor(concurrency) as article_pool:
+            with concurrent.futures.ThreadPoolExecutor(len(sources) or 1) as source_pool:
+                built_sources = list(source_pool.map(lambda x: build_source(x, article_pool, debug_mode, snapshot_store), sources))
+    if snapshot_store is not None:
+        for idx, source in enumerate(sources):
+            if built_sources[idx] is None:
+                built_sources[idx] = snapshot_store.load(source)
+                if built_sources[idx] is not None:
+                    logger.info('Using last snapshot of {}'.format(source.name))
+    return [x for x in built_sources if x is not None]
+
+
+def pull_image(job, webroot):
+    story, width, height = job
+    try:
+        with metrics.timer('unbiased_phase_seconds', source=story.source, phase='image_download'):
+            return pullImage(story.img, webroot, width, height)
+    except Exception as ex:
+        logger.warning('Image download failed: url={} ex={}'.format(story.img, ex))
+        return None, None
+
+
+def timed_transcode(*args):
+    # runs in the image pool, so the timing has to be sent back
+    start = time.process_time()
+    files = transcode_image(*args)
+    return files, time.process_time() - start
+
+
+class ImagePool(object):
+    """
+    The processes images are transcoded in. They're started on first use,
+    from a forkserver where there is one, since forking the crawler itself
+    would copy locks held by its other threads. If a worker dies (e.g. out
+    of memory) and breaks the pool, a new one is started, and if that
+    fails too the image is transcoded in-process.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _new_pool(self):
+        kwargs = {}
+        if sys.version_info >= (3, 7) and 'forkserver' in multiprocessing.get_all_start_methods():
+            kwargs['mp_context'] = multiprocessing.get_context('forkserver')
+        return concurrent.futures.ProcessPoolExecutor(self.workers, **kwargs)
+
+    def submit(self, func, *args):
+        with self._lock:
+            if self._pool is None:
+                self._pool = self._new_pool()
+            try:
+                return self._pool.submit(func, *args)
+            except BrokenProcessPool:
+                logger.warning('Image pool broke, starting a new one')
+                self._pool.shutdown(wait=False)
+                self._pool = self._new_pool()
             try:
-                built_sources.append(source.build())
-                break
-            except Exception as ex:
-                if debug_mode is True:
-                    raise
-                tries += 1
-                if tries == 3:
-                    logger.error('Build failed. source={} ex={}'.format(source.name, ex))
-                else:
-                    logger.debug('Build failed, retrying. source={} ex={}'.format(source.name, ex))
+                return self._pool.submit(func, *args)
+            except BrokenProcessPool:
+                return _completed(func, *args)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+def _completed(func, *args):
+    future = concurrent.futures.Future()
+    try:
+        future.set_result(func(*args))
+    except Exception as ex:
+        future.set_exception(ex)
+    return future
+
+
+def run(webroot, source_names, web_log_stream, debug_mode=False, concurrency=1, image_pool=None, publisher=None, snapshot_store=None):
+
+    logger.debug('Running with webroot="{}" for sources="{}"'.format(webroot, source_names))
+
+    sources = select_sources(source_names)
+    built_sources = build_sources(sources, concurrency, debug_mode, snapshot_store)
+    render(webroot, built_sources, web_log_stream, concurrency, image_pool, publisher)
+
+
+def render(webroot, built_sources, web_log_stream, concurrency=1, image_pool=None, publisher=None):
+    """
+    Pick stories from the built sources and publish the page.
+    """
     sources = tuple(built_sources)
     logger.info('Parsed home pages for: {}'.format([x.name for x in sources]))
 
@@ -127,26 +331,59 @@ def run(webroot, source_names, web_log_stream, debug_mode=False):
 
     files_to_write = {}
 
-    # download images
-    img_idx = 0
-    for story in top_stories:
-        story.img, img_jpg = pullImage(story.img, img_idx, webroot, 350, 200)
-        files_to_write[story.img] = img_jpg
-        img_idx += 1
-    for story in middle_stories:
-        story.img, img_jpg = pullImage(story.img, img_idx, webroot, 150, 100)
-        files_to_write[story.img] = img_jpg
-        img_idx += 1
+    # download images, then transcode them in the image pool
+    jobs = [(x, 350, 200) for x in top_stories] + [(x, 150, 100) for x in middle_stories]
+    with metrics.timer('unbiased_render_seconds', phase='image_download'):
+        with concurrent.futures.ThreadPoolExecutor(max(1, concurrency)) as download_pool:
+            downloads = list(download_pool.map(lambda x: pull_image(x, webroot), jobs))
     logger.info('Downloaded images')
+    pictures = [picture for picture, _ in downloads]
+    transcodes = []
+    pending = set()
+    for i, ((story, width, height), (picture, content)) in enumerate(zip(jobs, downloads)):
+        if content is None or picture.name in pending:
+            continue
+        pending.add(picture.name)
+        if image_pool is None:
+            transcodes.append((i, story, _completed(timed_transcode, content, picture, width, height)))
+        else:
+            transcodes.append((i, story, image_pool.submit(timed_transcode, content, picture, width, height)))
+    for i, story, future in transcodes:
+        try:
+            files, cpu_time = future.result()
+            metrics.observe('unbiased_phase_seconds', cpu_time, source=story.source, phase='image_transcode')
+            for name, data in files.items():
+                files_to_write[name] = data
+        except Exception as ex:
+            logger.warning('Image transcoding failed: url={} ex={}'.format(story.url, ex))
+            pictures[i] = None
+    # the stories belong to the built sources, which get rendered again
+    # later, so the pictures go on copies of them
+    stories = [story._replace(image=picture) for (story, _, _), picture in zip(jobs, pictures)]
+    top_stories = tuple(stories[:len(top_stories)])
+    middle_stories = tuple(stories[len(top_stories):])
+    logger.info('Transcoded images')
 
     # build the output file HTML
-    output_html = buildOutput(top_stories, middle_stories, bottom_stories)
-    output_html = io.BytesIO(output_html.encode('utf8'))
-    files_to_write['index.html'] = output_html
-    files_to_write['log.txt'] = io.BytesIO(web_log_stream.getvalue().encode('utf8'))
+    with metrics.timer('unbiased_render_seconds', phase='html'):
+        output_html = buildOutput(top_stories, middle_stories, bottom_stories)
+    files_to_write['index.html'] = output_html.encode('utf8')
+    files_to_write['log.txt'] = web_log_stream.getvalue().encode('utf8')
+    web_log_stream.seek(0)
+    web_log_stream.truncate()
+
+    if publisher is None:
+        publisher = Publisher(webroot)
+    with metrics.timer('unbiased_render_seconds', phase='publish'):
+        publisher.write_files(files_to_write)
+        publisher.write_static_files()
+        publisher.collect_images([name for story in top_stories + middle_stories if story.image for name in story.image.files()])
 
-    write_files(files_to_write, webroot)
-    write_static_files(webroot)
+    # metrics are written last, so they include this render
+    publisher.write_files({
+        'metrics.prom': metrics.prometheus().encode('utf8'),
+        'metrics.json': metrics.summary().encode('utf8'),
+    })
 
 
 if __name__ == "__main__":
@@ -0,0 +1,111 @@
+import contextlib
+import json
+import threading
+import time
+import urllib
+
+
+class Metrics(object):
+    """
+    Counters and timings for the crawl, labelled like Prometheus metrics,
+    plus a log of every request made since the last summary. Safe to use
+    from any thread.
+    """
+
+    max_fetches = 5000
+
+    def __init__(self):
+        self._counters = {}
+        self._timings = {}
+        self._fetches = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            timing = self._timings.get(key)
+            if timing is None:
+                timing = self._timings[key] = [0, 0.0, 0.0]
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = seconds
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start, **labels)
+
+    def record_fetch(self, url, status, seconds, size, cached):
+        host = urllib.parse.urlparse(url).netloc
+        self.inc('unbiased_fetch_responses_total', host=host, status=str(status))
+        self.inc('unbiased_fetch_bytes_total', size, host=host)
+        self.observe('unbiased_fetch_seconds', seconds, host=host)
+        with self._lock:
+            if len(self._fetches) < self.max_fetches:
+                self._fetches.append({
+                    'url': url,
+                    'status': status,
+                    'seconds': round(seconds, 4),
+                    'bytes': size,
+                    'cached': cached,
+                })
+
+    def prometheus(self):
+        """
+        Everything so far, in the Prometheus text exposition format.
+        """
+        def fmt(name, labels, value):
+            if labels:
+                labels = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in labels)
+                return '{}{{{}}} {}'.format(name, labels, repr(float(value)))
+            return '{} {}'.format(name, repr(float(value)))
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            timings = sorted(self._timings.items())
+        lines = []
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append('# TYPE {} counter'.format(name))
+                seen.add(name)
+            lines.append(fmt(name, labels, value))
+        for (name, labels), (count, total, last) in timings:
+            if name not in seen:
+                lines.append('# TYPE {} summary'.format(name))
+                seen.add(name)
+            lines.append(fmt(name + '_count', labels, count))
+            lines.append(fmt(name + '_sum', labels, total))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """
+        Everything so far as JSON, along with the requests made since the
+        last call, which are then forgotten.
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            timings = sorted(self._timings.items())
+            fetches = self._fetches
+            self._fetches = []
+        return json.dumps({
+            'time': int(time.time()),
+            'counters': [{'name': n, 'labels': dict(ls), 'value': v} for (n, ls), v in counters],
+            'timings': [{'name': n, 'labels': dict(ls), 'count': c, 'sum': round(s, 4), 'last': round(x, 4)} for (n, ls), (c, s, x) in timings],
+            'fetches': fetches,
+        }, indent=1)
+
+
+registry = Metrics()
@@ -0,0 +1,118 @@
+import codecs
+import functools
+import re
+
+from bs4 import BeautifulSoup
+import lxml.etree
+
+# how much of the document is handed to the parser at a time, so it can
+# stop soon after the <head> is over
+_chunk_size = 16 * 1024
+
+_head_end_pat = re.compile(br'</head\s*>|<body[\s>]', re.I)
+
+
+@functools.lru_cache(maxsize=None)
+def lxml_encoding(encoding):
+    """
+    A name libxml2 knows the charset 'encoding' by. That's either the
+    label as given or Python's name for it (e.g. iso8859-1 for latin-1),
+    or None if it knows neither.
+    """
+    names = [encoding]
+    try:
+        names.append(codecs.lookup(encoding).name.replace('_', '-'))
+    except LookupError:
+        pass
+    for name in names:
+        try:
+            lxml.etree.HTMLParser(encoding=name)
+        except LookupError:
+            continue
+        return name
+    return None
+
+
+def lxml_parser(parser_type, encoding, **kwargs):
+    """
+    An lxml parser of 'parser_type' for documents in 'encoding'. If
+    libxml2 doesn't know the encoding, the parser works it out itself.
+    """
+    if encoding is not None:
+        encoding = lxml_encoding(encoding)
+    return parser_type(encoding=encoding, **kwargs)
+
+
+def head(content):
+    """
+    The start of the html document 'content', up to the end of its <head>,
+    or all of it if the <head> never ends.
+    """
+    match = _head_end_pat.search(content)
+    if match is None:
+        return content
+    return content[:match.end()]
+
+
+def extract_meta(content, encoding=None):
+    """
+    Collect the <meta> tags of an html document into a dict, keyed by
+    their 'property', 'name' and 'itemprop' attributes. Only the <head> is
+    parsed, in a single pass, without building a BeautifulSoup tree. The
+    first tag with a given key wins.
+    """
+    meta = {}
+    parser = lxml_parser(lxml.etree.HTMLPullParser, encoding, events=('start', 'end'))
+    for offset in range(0, len(content), _chunk_size):
+        parser.feed(content[offset:offset + _chunk_size])
+        for event, element in parser.read_events():
+            if (event == 'end' and element.tag == 'head') or element.tag == 'body':
+                return meta
+            if event == 'start' and element.tag == 'meta':
+                value = element.get('content')
+                if value is None:
+                    continue
+                for attr in ['property', 'name', 'itemprop']:
+                    key = element.get(attr)
+                    if key is not None and key not in meta:
+                        meta[key] = value
+    return meta
+
+
+def parse_html(res):
+    """
+    A BeautifulSoup tree of the downloaded html document 'res'. The bytes
+    go straight to lxml, in the encoding the response declares, so the
+    body isn't decoded to a str first and its charset is never guessed.
+    The few charsets libxml2 doesn't know are decoded by Python instead.
+    """
+    encoding = res.encoding or 'utf-8'
+    name = lxml_encoding(encoding)
+    if name is None:
+        return BeautifulSoup(str(res.content, encoding, errors='replace'), 'lxml')
+    return BeautifulSoup(res.content, 'lxml', from_encoding=name)
+
+
+class Page(object):
+    """
+    A downloaded article page. 'meta' is all that most sources need, and
+    is cheap. 'soup' is a full BeautifulSoup tree of the document, only
+    built for sources that ask for it.
+    """
+
+    def __init__(self, res):
+        self._res = res
+        self._meta = None
+        self._soup = None
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            self._meta = extract_meta(self._res.content, self._res.encoding)
+        return self._meta
+
+    @property
+    def soup(self):
+        if self._soup is None:
+            self._soup = parse_html(self._res)
+        return self._soup
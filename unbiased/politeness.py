@@ -0,0 +1,233 @@
+import email.utils
+import logging
+import threading
+import time
+import urllib.parse
+import urllib.robotparser
+
+from unbiased.metrics import registry as metrics
+
+logger = logging.getLogger('unbiased')
+
+# every host starts out at 'default_rate' requests a second, with bursts
+# of up to 'burst' at once. each successful request raises its rate by
+# 'rate_step', up to 'max_rate' or what its robots.txt asks for, and
+# being told to slow down (THROTTLE_STATUSES) halves it.
+enabled = True
+default_rate = 4.0
+max_rate = 20.0
+min_rate = 0.1
+rate_step = 0.2
+burst = 4
+THROTTLE_STATUSES = (429, 503)
+
+# how long to stay off a host that is throttling us without saying for
+# how long, and the longest wait before giving up on a request instead
+default_retry_after = 5
+max_wait = 30
+
+# robots.txt is fetched once a day per host, or an hour after failing.
+# its rules are followed for 'user_agent', which every request sends.
+obey_robots = True
+user_agent = 'unbiased'
+robots_ttl = 24 * 60 * 60
+robots_retry = 60 * 60
+max_robots_size = 512 * 1024
+
+
+def configure(rate=None, obey=None, enable=None):
+    global default_rate, obey_robots, enabled
+    if rate is not None:
+        default_rate = max(min_rate, rate)
+    if obey is not None:
+        obey_robots = obey
+    if enable is not None:
+        enabled = enable
+
+
+def retry_after(headers, now=None):
+    """
+    Seconds to wait according to a Retry-After header, which is either a
+    number of seconds or a date, or None if there isn't a valid one.
+    """
+    value = headers.get('retry-after')
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(0, when.timestamp() - (now or time.time()))
+
+
+class HostPolicy(object):
+    """
+    How fast one host may be crawled: a token bucket whose rate adapts
+    to how the host responds (additive increase, multiplicative
+    decrease), a time before which it mustn't be asked anything at all,
+    and its robots.txt.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.ceiling = max_rate
+        self.rate = min(default_rate, self.ceiling)
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.robots = None
+        self.robots_expires = 0
+        self._lock = threading.Lock()
+        self._robots_lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+    def reserve(self, limit=None):
+        """
+        Take a token for one request, and return how many seconds to wait
+        before making it. Tokens can be taken before they come in, so
+        requests queue up in the order they asked. If the wait would be
+        over 'limit', no token is taken.
+        """
+        with self._lock:
+            now = self._refill()
+            tokens = self.tokens - 1
+            wait = max(-tokens / self.rate if tokens < 0 else 0, self.blocked_until - now)
+            if limit is None or wait <= limit:
+                self.tokens = tokens
+            return wait
+
+    def success(self):
+        with self._lock:
+            self._refill()
+            self.rate = min(self.ceiling, self.rate + rate_step)
+
+    def throttled(self, seconds):
+        with self._lock:
+            now = self._refill()
+            self.rate = max(min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            logger.info('Throttled: host={} wait={}s rate={:.2f}/s'.format(self.host, int(seconds), self.rate))
+
+    def _set_robots(self, robots, expires):
+        delay = robots.crawl_delay(user_agent)
+        request_rate = robots.request_rate(user_agent)
+        ceiling = max_rate
+        if delay:
+            ceiling = min(ceiling, 1 / float(delay))
+        if request_rate:
+            ceiling = min(ceiling, request_rate.requests / request_rate.seconds)
+        with self._lock:
+            self._refill()
+            self.robots = robots
+            self.robots_expires = expires
+            self.ceiling = max(min_rate, ceiling)
+            self.rate = min(self.rate, self.ceiling)
+            if ceiling < max_rate:
+                self.burst = 1
+                self.tokens = min(self.tokens, 1)
+        if ceiling < max_rate:
+            logger.debug('Crawl rate from robots.txt: host={} rate={:.2f}/s'.format(self.host, ceiling))
+
+    def allowed(self, url, load):
+        """
+        Whether robots.txt lets 'url' be fetched. 'load' is called with
+        the url of robots.txt when it needs to be fetched, and should
+        return (status code, body).
+        """
+        if not obey_robots:
+            return True
+        with self._robots_lock:
+            if time.monotonic() >= self.robots_expires:
+                parts = urllib.parse.urlparse(url)
+                robots_url = urllib.parse.urlunparse((parts.scheme, parts.netloc, '/robots.txt', '', '', ''))
+                robots = urllib.robotparser.RobotFileParser(robots_url)
+                expires = time.monotonic() + robots_ttl
+                try:
+                    status, body = load(robots_url)
+                except Exception as ex:
+                    logger.debug('robots.txt failed: host={} ex={}'.format(self.host, ex))
+                    status, body = None, b''
+                if status == 200:
+                    robots.parse(body[:max_robots_size].decode('utf8', errors='replace').splitlines())
+                else:
+                    # missing means anything goes. unavailable should
+                    # mean nothing does, but we'd rather try again soon.
+                    robots.allow_all = True
+                    if status is None or status >= 500:
+                        expires = time.monotonic() + robots_retry
+                self._set_robots(robots, expires)
+        return self.robots.can_fetch(user_agent, url)
+
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+
+def policy_for(url):
+    host = urllib.parse.urlparse(url).netloc
+    with _policies_lock:
+        policy = _policies.get(host)
+        if policy is None:
+            policy = HostPolicy(host)
+            _policies[host] = policy
+        return policy
+
+
+def allowed(url, load):
+    """
+    Whether robots.txt lets 'url' be fetched, see HostPolicy.allowed().
+    """
+    if not enabled:
+        return True
+    return policy_for(url).allowed(url, load)
+
+
+def wait(url):
+    """
+    Wait for the host of 'url' to be ready for another request. Returns
+    the seconds waited, or None without waiting if it would take longer
+    than 'max_wait'.
+    """
+    if not enabled:
+        return 0
+    policy = policy_for(url)
+    seconds = policy.reserve(max_wait)
+    if seconds > max_wait:
+        metrics.inc('unbiased_politeness_total', host=policy.host, result='gave_up')
+        return None
+    if seconds > 0:
+        metrics.observe('unbiased_politeness_wait_seconds', seconds, host=policy.host)
+        time.sleep(seconds)
+    return seconds
+
+
+def record(url, status, headers):
+    """
+    Note how the host of 'url' responded. Returns how many seconds it
+    asked to be left alone for, if it's throttling, or None.
+    """
+    if not enabled:
+        return None
+    policy = policy_for(url)
+    if status in THROTTLE_STATUSES:
+        seconds = retry_after(headers)
+        if seconds is None:
+            seconds = default_retry_after
+        metrics.inc('unbiased_politeness_total', host=policy.host, result='throttled')
+        policy.throttled(seconds)
+        return seconds
+    if status < 500:
+        policy.success()
+    return None
@@ -0,0 +1,157 @@
+import gzip
+import hashlib
+import io
+import logging
+import os
+import pkgutil
+import tempfile
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger('unbiased')
+
+STATIC_FILES = ['unbiased.css', 'favicon.ico', 'favicon.png', 'apple-touch-icon.png']
+
+# derived images live here, relative to the webroot
+IMAGE_DIR = 'img'
+
+# files of these types get precompressed copies next to them, for the web
+# server to send as-is (nginx's gzip_static and brotli_static)
+COMPRESSED_TYPES = ['.html', '.txt', '.css']
+
+
+def gzip_compress(data):
+    # no timestamp in the header, so unchanged data compresses to
+    # unchanged bytes and the write gets skipped
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9, mtime=0) as fp:
+        fp.write(data)
+    return out.getvalue()
+
+
+def compressors():
+    ret = [('.gz', gzip_compress)]
+    if brotli is not None:
+        ret.append(('.br', brotli.compress))
+    return ret
+
+
+class Publisher(object):
+    """
+    Writes files into the webroot. Every file is written to a temporary
+    file next to it and renamed into place, so the web server never sees
+    a half-written file, and files whose content hasn't changed since the
+    last write aren't touched at all.
+    """
+
+    def __init__(self, webroot, image_grace=60 * 60):
+        self.webroot = webroot
+        # unused images are kept around this long, for pages that are
+        # still open or cached somewhere
+        self.image_grace = image_grace
+        self._image_seen = {}
+        self._digests = {}
+        self._static_written = False
+        self._lock = threading.Lock()
+
+    def _digest_on_disk(self, path):
+        try:
+            with open(path, 'rb') as fp:
+                return hashlib.sha1(fp.read()).hexdigest()
+        except OSError:
+            return None
+
+    def write(self, name, data):
+        """
+        Write 'data' to 'name' in the webroot, unless it's already there,
+        along with its compressed copies if it's one of COMPRESSED_TYPES.
+        Returns True if the file was written.
+        """
+        written = self._write(name, data)
+        if os.path.splitext(name)[1] in COMPRESSED_TYPES:
+            for suffix, compress in compressors():
+                if written or not os.path.exists(os.path.join(self.webroot, name + suffix)):
+                    self._write(name + suffix, compress(data))
+        return written
+
+    def _write(self, name, data):
+        path = os.path.join(self.webroot, name)
+        digest = hashlib.sha1(data).hexdigest()
+        with self._lock:
+            if name not in self._digests:
+                self._digests[name] = self._digest_on_disk(path)
+            if self._digests[name] == digest:
+                return False
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+            # mkstemp makes the file private, but the web server has to read it
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            self._digests[name] = digest
+        return True
+
+    def write_files(self, files_to_write):
+        written = [name for name, data in files_to_write.items() if self.write(name, data)]
+        logger.debug('Wrote {} of {} files: {}'.format(len(written), len(files_to_write), written))
+
+    def write_static_files(self):
+        """
+        Copy over the static package files. They can only change when the
+        package is upgraded, which means a restart, so once is enough.
+        """
+        if self._static_written:
+            return
+        for filename in STATIC_FILES:
+            data = pkgutil.get_data('unbiased', os.path.join('html_template', filename))
+            self.write(filename, data)
+        self._static_written = True
+
+    def collect_images(self, keep):
+        """
+        Delete derived images that aren't in 'keep' and haven't been on a
+        page for 'image_grace' seconds. Images that were already there
+        when the publisher started count as on the page until then.
+        """
+        directory = os.path.join(self.webroot, IMAGE_DIR)
+        keep = set(os.path.normpath(os.path.join(self.webroot, x)) for x in keep)
+        now = time.time()
+        oldest = now - self.image_grace
+        removed = 0
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            return
+        # images aren't written again while they're in use, so when one
+        # was last on a page is kept here rather than in its mtime
+        seen = {}
+        for entry in entries:
+            path = os.path.normpath(entry.path)
+            seen[path] = now if path in keep else self._image_seen.get(path, now)
+            if seen[path] >= oldest:
+                continue
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+            del seen[path]
+            removed += 1
+            with self._lock:
+                self._digests.pop(os.path.relpath(entry.path, self.webroot), None)
+        self._image_seen = seen
+        logger.debug('Removed {} stale images'.format(removed))
@@ -0,0 +1,117 @@
+import collections
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger('unbiased')
+
+# request timeouts are twice the recent p95 latency of the host, within
+# these bounds. hosts with too few samples get the default.
+default_timeout = 3
+min_timeout = 1
+max_timeout = 10
+min_samples = 5
+
+
+class LatencyTracker(object):
+    """
+    The last 'window' latencies of every key, such as a host.
+    """
+
+    def __init__(self, window=50):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds):
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = collections.deque(maxlen=self.window)
+                self._samples[key] = samples
+            samples.append(seconds)
+
+    def count(self, key):
+        with self._lock:
+            return len(self._samples.get(key, ()))
+
+    def percentile(self, key, pct):
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if not samples:
+            return None
+        idx = min(len(samples) - 1, int(len(samples) * pct / 100))
+        return samples[idx]
+
+
+host_latency = LatencyTracker()
+
+
+def timeout_for(host):
+    if host_latency.count(host) < min_samples:
+        return default_timeout
+    return min(max_timeout, max(min_timeout, 2 * host_latency.percentile(host, 95)))
+
+
+def backoff(attempt, base=1, cap=30):
+    """
+    Seconds to wait before retry number 'attempt' (counting from 1), with
+    full jitter so retries against the same host don't line up.
+    """
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker(object):
+    """
+    Stops crawling a source that keeps failing. After 'threshold' failed
+    builds in a row (or a single one that retrying won't fix) the breaker
+    opens and allow() says no for 'cooldown' seconds, doubling every time
+    it opens again without a success in between, up to 'max_cooldown'.
+    Once the cooldown is over, one build is let through to try again.
+    """
+
+    def __init__(self, name, threshold=3, cooldown=15 * 60, max_cooldown=6 * 60 * 60):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.failures = 0
+        self.opened = 0
+        self.open_until = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            return time.time() >= self.open_until
+
+    def success(self):
+        with self._lock:
+            if self.opened:
+                logger.info('Circuit closed: source={}'.format(self.name))
+            self.failures = 0
+            self.opened = 0
+            self.open_until = 0
+
+    def failure(self, permanent=False):
+        with self._lock:
+            self.failures += 1
+            if not permanent and self.failures < self.threshold:
+                return
+            cooldown = min(self.max_cooldown, self.cooldown * 2 ** self.opened)
+            self.opened += 1
+            self.open_until = time.time() + cooldown
+            logger.warning('Circuit open: source={} failures={} cooldown={}s'.format(self.name, self.failures, int(cooldown)))
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(source):
+    with _breakers_lock:
+        breaker = _breakers.get(source.shortname)
+        if breaker is None:
+            breaker = CircuitBreaker(source.name)
+            _breakers[source.shortname] = breaker
+        return breaker
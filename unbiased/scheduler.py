@@ -0,0 +1,106 @@
+import concurrent.futures
+import heapq
+import logging
+import random
+import time
+
+logger = logging.getLogger('unbiased')
+
+
+class Scheduler(object):
+    """
+    Crawls every source on its own timer, as set by its 'refresh_interval'
+    and 'refresh_jitter', and renders the page from the latest good build
+    of every source each time one or more of them finish. A slow or
+    failing source only holds up itself.
+
+    'build' is called with a source class and returns the built source,
+    or None if it failed. 'render' is called with the built sources.
+    'snapshots' are builds to start out with, {source: (time built,
+    build)}; if there are any, the page is rendered from them before the
+    first crawl. Builds older than 'max_age' seconds are left off the
+    page, so a source that stops building doesn't keep old stories up.
+    Otherwise the first page waits until every source has been crawled
+    once, or 'first_render_timeout' seconds have passed, so it isn't
+    made from whichever source happened to finish first.
+    """
+
+    def __init__(self, sources, build, render, snapshots=None, first_render_timeout=5 * 60, max_age=6 * 60 * 60):
+        self.sources = tuple(sources)
+        self._build = build
+        self._render = render
+        self._snapshots = dict(snapshots or {})
+        self.max_age = max_age
+        self.first_render_timeout = first_render_timeout
+        self._queue = []
+        self._order = {x: i for i, x in enumerate(self.sources)}
+
+    def _schedule(self, source, delay):
+        heapq.heappush(self._queue, (time.time() + delay, self._order[source], source))
+
+    def _next_delay(self, source):
+        jitter = random.uniform(-source.refresh_jitter, source.refresh_jitter)
+        return max(0, source.refresh_interval + jitter)
+
+    def snapshots(self):
+        """
+        The latest good build of every source, in the order the sources
+        were given in, unless it's older than 'max_age'.
+        """
+        oldest = time.time() - self.max_age
+        for source in self.sources:
+            snapshot = self._snapshots.get(source)
+            if snapshot is not None and snapshot[0] < oldest:
+                logger.info('Dropping old build of {}, from {}s ago'.format(source.name, int(time.time() - snapshot[0])))
+                del self._snapshots[source]
+        return [self._snapshots[x][1] for x in self.sources if x in self._snapshots]
+
+    def run_forever(self):
+        if not self.sources:
+            return
+        rendered = False
+        if self._snapshots:
+            logger.info('Rendering saved snapshots of: {}'.format([x.name for x in self.sources if x in self._snapshots]))
+            self._render(self.snapshots())
+            rendered = True
+        first_render_by = time.time() + self.first_render_timeout
+        uncrawled = set(self.sources)
+        for source in self.sources:
+            self._schedule(source, 0)
+        pending = {}
+        with concurrent.futures.ThreadPoolExecutor(len(self.sources)) as pool:
+            while True:
+                now = time.time()
+                while self._queue and self._queue[0][0] <= now:
+                    _, _, source = heapq.heappop(self._queue)
+                    pending[pool.submit(self._timed_build, source)] = source
+                timeout = self._queue[0][0] - now if self._queue else None
+                if not rendered and (timeout is None or timeout > first_render_by - now):
+                    timeout = max(0, first_render_by - now)
+                if not pending:
+                    time.sleep(timeout)
+                    continue
+                done, _ = concurrent.futures.wait(pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    source = pending.pop(future)
+                    built, runtime = future.result()
+                    delay = self._next_delay(source)
+                    if built is not None:
+                        self._snapshots[source] = (time.time(), built)
+                    uncrawled.discard(source)
+                    logger.info('Crawled {} in {}s. Next crawl in {}s'.format(source.name, int(runtime), int(delay)))
+                    self._schedule(source, delay)
+                if not rendered:
+                    if uncrawled and time.time() < first_render_by:
+                        continue
+                    if uncrawled:
+                        logger.info('Rendering before the first crawl of: {}'.format([x.name for x in self.sources if x in uncrawled]))
+                    rendered = True
+                elif not done:
+                    continue
+                self._render(self.snapshots())
+
+    def _timed_build(self, source):
+        start = time.time()
+        built = self._build(source)
+        return built, time.time() - start
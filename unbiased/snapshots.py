@@ -0,0 +1,87 @@
+import logging
+import sqlite3
+import time
+
+from unbiased import codec
+
+logger = logging.getLogger('unbiased')
+
+# how old a build can be and still stand in for a source
+default_max_age = 6 * 60 * 60
+
+
+class SnapshotStore(object):
+    """
+    The last successful build of every source, kept in a SQLite database
+    so it can stand in for a source that fails to crawl, and so the page
+    can be rendered right away after a restart. Snapshots older than
+    'max_age' seconds are never handed out.
+    """
+
+    def __init__(self, path, max_age=default_max_age):
+        self.path = path
+        self.max_age = max_age
+        db = self._connect()
+        try:
+            with db:
+                db.execute('CREATE TABLE IF NOT EXISTS snapshots (source TEXT PRIMARY KEY, built REAL, articles BLOB)')
+        finally:
+            db.close()
+
+    def _connect(self):
+        # a connection per call, since builds finish on different threads
+        return sqlite3.connect(self.path, timeout=10)
+
+    @staticmethod
+    def _encode(built):
+        return sqlite3.Binary(codec.encode([built.h1s, built.h2s, built.h3s]))
+
+    @staticmethod
+    def _decode(source, data):
+        return source(*codec.decode(data))
+
+    def save(self, source, built):
+        db = self._connect()
+        try:
+            with db:
+                db.execute('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)', (source.shortname, time.time(), self._encode(built)))
+        finally:
+            db.close()
+
+    def _load(self, source):
+        db = self._connect()
+        try:
+            row = db.execute('SELECT built, articles FROM snapshots WHERE source = ?', (source.shortname,)).fetchone()
+        finally:
+            db.close()
+        if row is None:
+            return None
+        built, data = row
+        if built < time.time() - self.max_age:
+            logger.debug('Snapshot too old: source={} age={}s'.format(source.name, int(time.time() - built)))
+            return None
+        try:
+            return built, self._decode(source, data)
+        except Exception as ex:
+            logger.warning('Bad snapshot: source={} ex={}'.format(source.name, ex))
+            return None
+
+    def load(self, source):
+        """
+        Return the last good build of 'source', or None if there isn't a
+        recent enough one.
+        """
+        snapshot = self._load(source)
+        return snapshot[1] if snapshot is not None else None
+
+    def load_all(self, sources):
+        """
+        Return {source: (time built, build)} for every source with a
+        usable snapshot.
+        """
+        snapshots = {}
+        for source in sources:
+            snapshot = self._load(source)
+            if snapshot is not None:
+                snapshots[source] = snapshot
+        return snapshots
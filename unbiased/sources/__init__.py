@@ -1,11 +1,147 @@
+import functools
 import importlib
-import pkgutil
+import logging
+import os
+import threading
 
 from unbiased.sources.base import NewsSource
+from unbiased.sources.declarative import load_definition
 
+logger = logging.getLogger('unbiased')
 
-def get_sources():
-    for loader, name, is_pkg in pkgutil.walk_packages(__path__):
-        if name != 'base':
-            importlib.import_module('unbiased.sources.' + name)
-    return {x.shortname.lower(): x for x in NewsSource.__subclasses__()}
+# the sources that come with unbiased, by lowercased short name. each is
+# only imported once it's asked for.
+BUILTIN_SOURCES = {
+    'abc': 'unbiased.sources.abc:ABC',
+    'bbc': 'unbiased.sources.bbc:BBC',
+    'cbs': 'unbiased.sources.cbs:CBS',
+    'fox': 'unbiased.sources.fox:Fox',
+    'guardian': 'unbiased.sources.guardian:TheGuardian',
+    'hill': 'unbiased.sources.thehill:TheHill',
+    'nbc': 'unbiased.sources.nbc:NBC',
+    'npr': 'unbiased.sources.npr:NPR',
+    'washtimes': 'unbiased.sources.washtimes:TheWashingtonTimes',
+}
+
+# sources defined by selector rules rather than code (see
+# unbiased.sources.declarative), one file per source named after its
+# short name, are read from here and any directories added with
+# SourceRegistry.add_definitions()
+DEFINITIONS_DIR = os.path.join(os.path.dirname(__file__), 'defs')
+DEFINITION_TYPES = ['.json', '.yaml', '.yml']
+
+# other packages can add sources by declaring entry points in this group,
+# named after the source's short name, e.g. in setup.py:
+#
+#     entry_points={'unbiased.sources': ['mysource = mypackage.mysource:MySource']}
+ENTRY_POINT_GROUP = 'unbiased.sources'
+
+
+def _entry_points():
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        try:
+            from importlib_metadata import entry_points
+        except ImportError:
+            import pkg_resources
+            return list(pkg_resources.iter_entry_points(ENTRY_POINT_GROUP))
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        return list(eps.select(group=ENTRY_POINT_GROUP))
+    return list(eps.get(ENTRY_POINT_GROUP, []))
+
+
+def _definitions(directory):
+    ret = {}
+    for filename in sorted(os.listdir(directory)):
+        name, ext = os.path.splitext(filename)
+        if ext in DEFINITION_TYPES:
+            ret[name.lower()] = os.path.join(directory, filename)
+    return ret
+
+
+def _import(spec):
+    module_name, class_name = spec.split(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+class SourceRegistry(object):
+    """
+    Every known source, by lowercased short name. The names are found
+    once, without importing anything, and each source is imported (or
+    made from its definition file) the first time it's asked for.
+    """
+
+    def __init__(self):
+        self._specs = None
+        self._loaded = {}
+        self._definition_dirs = [DEFINITIONS_DIR]
+        self._lock = threading.Lock()
+
+    def add_definitions(self, directory):
+        """
+        Also read source definition files from 'directory'.
+        """
+        with self._lock:
+            self._definition_dirs.append(directory)
+            self._specs = None
+
+    def _find(self):
+        # every source is found as a function that loads it
+        specs = {k: functools.partial(_import, v) for k, v in BUILTIN_SOURCES.items()}
+        for directory in self._definition_dirs:
+            for name, path in _definitions(directory).items():
+                if name in specs:
+                    logger.warning('Source definition clashes with an existing source: path={}'.format(path))
+                    continue
+                specs[name] = functools.partial(load_definition, path)
+        try:
+            entry_points = _entry_points()
+        except Exception as ex:
+            logger.warning('Could not look for source plugins: ex={}'.format(ex))
+            entry_points = []
+        for ep in entry_points:
+            name = ep.name.lower()
+            if name in specs:
+                logger.warning('Source plugin clashes with an existing source: name={}'.format(name))
+                continue
+            specs[name] = ep.load
+        return specs
+
+    def names(self):
+        with self._lock:
+            if self._specs is None:
+                self._specs = self._find()
+            return sorted(self._specs)
+
+    def load(self, name):
+        """
+        Return the source class called 'name', importing it if needed.
+        """
+        name = name.lower()
+        known = self.names()
+        with self._lock:
+            source = self._loaded.get(name)
+            if source is not None:
+                return source
+            if name not in self._specs:
+                raise KeyError('Unknown source: {} (known sources: {})'.format(name, ', '.join(known)))
+            source = self._specs[name]()
+            if not (isinstance(source, type) and issubclass(source, NewsSource)):
+                raise TypeError('Source {} is not a NewsSource: {}'.format(name, source))
+            self._loaded[name] = source
+            return source
+
+
+registry = SourceRegistry()
+
+
+def get_sources(names=None):
+    """
+    Return {short name: source class} for the sources called 'names', or
+    for every source if not given.
+    """
+    if names is None:
+        names = registry.names()
+    return {x.lower(): registry.load(x) for x in names}
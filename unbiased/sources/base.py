@@ -1,24 +1,30 @@
+import collections
 import logging
+import sys
+import time
 import urllib
 
-from bs4 import BeautifulSoup
-import requests
+from unbiased import feeds, fetch, filters
+from unbiased.metrics import registry as metrics
+from unbiased.page import Page, head, parse_html
 
 logger = logging.getLogger('unbiased')
 
 
-class Article(object):
+class Article(collections.namedtuple('Article', ['source', 'title', 'author', 'description', 'url', 'img', 'image'])):
+    """
+    A story. 'img' is the url of its image, and 'image' the Picture made
+    from that for the page, if there is one yet. Articles can't be
+    changed, so one with a Picture is a copy made with _replace().
+    """
 
-    def __init__(self, source, title, author, description, url, img):
-        self.source = source
-        self.title = title
-        self.author = author
-        self.description = description
-        self.url = url
-        self.img = img
+    __slots__ = ()
 
-    def __repr__(self):
-        return 'Article({}, {}, {}, {}, {}, {})'.format(self.source, self.title, self.author, self.description, self.url, self.img)
+    def __new__(cls, source, title, author, description, url, img, image=None):
+        # there are only a handful of sources, shared by every article
+        if source is not None:
+            source = sys.intern(source)
+        return super().__new__(cls, source, title, author, description, url, img, image)
 
 
 class NewsSource(object):
@@ -26,10 +32,19 @@ class NewsSource(object):
     Abstract base class.
     To implement:
      - set 'name', 'shortname', and 'url'
-     - set 'bad_' variables to blacklist terms and phrases
+     - set 'bad_' variables to blacklist terms and phrases, or
+       regexes prefixed with 're:' (see unbiased.filters)
      - implement '_fetch_urls()', which should return three tuples
        of urls, one for each tier
-     - override any of the '_get_*()' functions as necessary
+     - set 'feed_url' if the source has an RSS/Atom feed or a news
+       sitemap, which is used instead of the home page and article
+       pages when 'prefer_feeds' is set
+     - set 'refresh_interval' and 'refresh_jitter' to crawl more or less
+       often than every ten minutes
+     - override any of the '_get_*()' functions as necessary. they are
+       given a Page, and should stick to 'page.meta' unless they need
+       the article body, in which case set 'needs_article_body' and
+       use 'page.soup'
     """
 
     name = None
@@ -42,31 +57,113 @@ class NewsSource(object):
     bad_imgs = None
     bad_urls = None
 
+    # how likely the source's stories are to be picked, relative to
+    # other sources
+    weight = 1
+
+    # seconds between crawls, give or take up to 'refresh_jitter' seconds
+    refresh_interval = 600
+    refresh_jitter = 30
+
+    # width of the largest image rendition, for sources that can pick
+    # between several sizes of an image
+    image_width = 700
+
+    # article pages are only downloaded up to the end of their <head>,
+    # unless the source needs something from the body
+    needs_article_body = False
+
+    # an optional unbiased.cache.ArticleCache shared by all sources
+    article_cache = None
+
+    # with 'prefer_feeds', sources with a 'feed_url' are built from their
+    # feed, whose first stories make up the tiers, as many as given in
+    # 'feed_tiers'. article pages are only fetched for stories the feed
+    # is missing something of.
+    feed_url = None
+    feed_tiers = (1, 5, 10)
+    prefer_feeds = False
+
     def __init__(self, h1s, h2s, h3s):
         self.h1s = h1s
         self.h2s = h2s
         self.h3s = h3s
 
     @classmethod
-    def build(cls):
-        h1s, h2s, h3s = cls._fetch_urls()
-        h1s = tuple(cls._normalize_url(x) for x in h1s)
-        h2s = tuple(cls._normalize_url(x) for x in h2s)
-        h3s = tuple(cls._normalize_url(x) for x in h3s)
-        h1s, h2s, h3s = cls._remove_duplicates(h1s, h2s, h3s)
-        h1s, h2s, h3s = cls._fetch_articles(h1s, h2s, h3s)
-        h1s, h2s, h3s = cls._remove_all_bad_stories(h1s, h2s, h3s)
+    def build(cls, pool=None):
+        """
+        Crawl the source. If 'pool' is given, it should be an executor
+        that the article pages will be fetched with.
+        """
+        articles = None
+        if cls.prefer_feeds and cls.feed_url:
+            try:
+                with metrics.timer('unbiased_phase_seconds', source=cls.name, phase='fetch_feed'):
+                    articles = cls._fetch_feed(pool)
+            except Exception as ex:
+                logger.warning('Feed failed, using the home page: source={} ex={}'.format(cls.name, ex))
+        if articles is None:
+            with metrics.timer('unbiased_phase_seconds', source=cls.name, phase='fetch_urls'):
+                h1s, h2s, h3s = cls._fetch_urls()
+            h1s = tuple(cls._normalize_url(x) for x in h1s)
+            h2s = tuple(cls._normalize_url(x) for x in h2s)
+            h3s = tuple(cls._normalize_url(x) for x in h3s)
+            h1s, h2s, h3s = cls._remove_duplicates(h1s, h2s, h3s)
+            with metrics.timer('unbiased_phase_seconds', source=cls.name, phase='fetch_articles'):
+                articles = cls._fetch_articles(h1s, h2s, h3s, pool)
+        h1s, h2s, h3s = articles
+        with metrics.timer('unbiased_phase_seconds', source=cls.name, phase='remove_bad_stories'):
+            h1s, h2s, h3s = cls._remove_all_bad_stories(h1s, h2s, h3s)
         logger.info('Fetched {} h1s, {} h2s, {} h3s'.format(len(h1s), len(h2s), len(h3s)))
         return cls(h1s, h2s, h3s)
 
     @classmethod
-    def _fetch_content(cls, url):
-        res = requests.get(url, timeout=3)
-        if res.status_code == 200:
-            content = res.text
+    def _fetch_feed(cls, pool=None):
+        res = cls._download(cls.feed_url)
+        items = []
+        urls = set()
+        for item in feeds.parse_feed(res.content, cls.image_width):
+            item = item._replace(url=cls._normalize_url(item.url))
+            if item.url not in urls:
+                urls.add(item.url)
+                items.append(item)
+        if not items:
+            raise fetch.DownloadError('No stories in feed {}'.format(cls.feed_url))
+        tiers = []
+        start = 0
+        for size in cls.feed_tiers:
+            tiers.append(items[start:start + size])
+            start += size
+        if pool is None:
+            results = [map(cls._feed_article, x) for x in tiers]
         else:
-            raise Exception("Failed to download {}".format(url))
-        return BeautifulSoup(content, 'lxml')
+            results = [pool.map(cls._feed_article, x) for x in tiers]
+        return tuple(tuple(x for x in tier if x is not None) for tier in results)
+
+    @classmethod
+    def _feed_article(cls, item):
+        if not (item.title and item.description and item.img):
+            metrics.inc('unbiased_feed_items_total', source=cls.name, result='fetched')
+            return cls._fetch_article(item.url)
+        metrics.inc('unbiased_feed_items_total', source=cls.name, result='complete')
+        img = urllib.parse.urlparse(item.img, scheme=urllib.parse.urlparse(item.url).scheme).geturl()
+        description = cls._remove_self_refs(item.description)
+        return Article(cls.name, item.title, item.author, description, item.url, img)
+
+    @classmethod
+    def _fetch_content(cls, url):
+        return cls._parse(cls._download(url))
+
+    @classmethod
+    def _download(cls, url, head_only=False):
+        res = fetch.get(url, stop_at=b'</head>' if head_only else None)
+        if res.status_code != 200:
+            raise fetch.DownloadError("Failed to download {}".format(url))
+        return res
+
+    @classmethod
+    def _parse(cls, res):
+        return parse_html(res)
 
     @classmethod
     def _normalize_url(cls, url, keep_query_vars=None):
@@ -99,47 +196,36 @@ class NewsSource(object):
         h3s = tuple(x for x in h3s if x not in h1s and x not in h2s)
         return h1s, h2s, h3s
 
-    @classmethod
-    def _remove_bad_stories(cls, articles, element, filters):
-        # TODO: replace string filters with regex filters
-        if filters is None:
-            return articles
-        new_articles = []
-        for article in articles:
-            save = True
-            for f in filters:
-                if getattr(article, element) and f in getattr(article, element):
-                    save = False
-                    break
-            if save:
-                new_articles.append(article)
-        return tuple(new_articles)
-
     @classmethod
     def _remove_all_bad_stories(cls, h1s, h2s, h3s):
+        blocklist = filters.blocklist_for(cls)
         new_articles = []
         for articles in [h1s, h2s, h3s]:
-            articles = cls._remove_bad_stories(articles, 'title', cls.bad_titles)
-            articles = cls._remove_bad_stories(articles, 'description', cls.bad_descriptions)
-            articles = cls._remove_bad_stories(articles, 'author', cls.bad_authors)
-            articles = cls._remove_bad_stories(articles, 'img', cls.bad_imgs)
-            articles = cls._remove_bad_stories(articles, 'url', cls.bad_urls)
-            new_articles.append(articles)
+            kept = []
+            for article in articles:
+                field = blocklist.match(article)
+                if field is None:
+                    kept.append(article)
+                else:
+                    logger.debug('Blocked: source={} field={} url={}'.format(cls.name, field, article.url))
+                    metrics.inc('unbiased_blocked_articles_total', source=cls.name, field=field)
+            new_articles.append(kept)
         if len(new_articles[0]) == 0 and len(new_articles[1]) > 0:
             new_articles[0] = new_articles[0] + new_articles[1][:1]
             new_articles[1] = new_articles[1][1:]
         return tuple(tuple(x) for x in new_articles)
 
     @classmethod
-    def _fetch_articles(cls, h1s, h2s, h3s):
+    def _fetch_articles(cls, h1s, h2s, h3s, pool=None):
+        # submit every tier up front so all the articles are fetched
+        # at once; map() hands the results back in submission order
+        if pool is None:
+            results = [map(cls._fetch_article, urls) for urls in [h1s, h2s, h3s]]
+        else:
+            results = [pool.map(cls._fetch_article, urls) for urls in [h1s, h2s, h3s]]
         ret = []
-        for urls in [h1s, h2s, h3s]:
-            articles = []
-            for url in urls:
-                article = cls._fetch_article(url)
-                if article is not None:
-                    articles.append(article)
-            ret.append(articles)
+        for tier in results:
+            ret.append([x for x in tier if x is not None])
         return tuple(tuple(x) for x in ret)
 
     @classmethod
@@ -148,28 +234,43 @@ class NewsSource(object):
         logger.debug(url)
 
         try:
-            soup = cls._fetch_content(url)
+            res = cls._download(url, head_only=not cls.needs_article_body)
         except Exception as ex:
             logger.debug("""ARTICLE DOWNLOADING ERROR
             SOURCE:\t{}
             URL:\t{}""".format(cls.name, url))
             return None
 
+        digest = None
+        if cls.article_cache is not None:
+            # pages read for their <head> alone come with some of the body,
+            # which is often different every time (ad ids, timestamps)
+            digest = cls.article_cache.digest(res.content if cls.needs_article_body else head(res.content))
+            article = cls.article_cache.lookup(url, digest)
+            if article is not None:
+                logger.debug('Article cache hit')
+                metrics.inc('unbiased_article_cache_total', result='hit')
+                return article
+            metrics.inc('unbiased_article_cache_total', result='miss')
+
+        page = Page(res)
+
         url_parts = urllib.parse.urlparse(url)
         scheme = url_parts.scheme
 
+        start = time.time()
         try:
-            img = cls._get_image(soup)
+            img = cls._get_image(page)
             img = urllib.parse.urlparse(img, scheme=scheme).geturl()
             logger.debug(img)
 
-            title = cls._get_title(soup)
+            title = cls._get_title(page)
             logger.debug(title)
 
-            author = cls._get_author(soup)
+            author = cls._get_author(page)
             logger.debug(author)
 
-            description = cls._get_description(soup)
+            description = cls._get_description(page)
             logger.debug(description)
             description = cls._remove_self_refs(description)
             logger.debug(description)
@@ -178,29 +279,32 @@ class NewsSource(object):
             SOURCE:\t{}
             URL:\t{}""".format(cls.name, url))
             return None
+        finally:
+            metrics.observe('unbiased_parse_seconds', time.time() - start, source=cls.name)
 
-        return Article(cls.name, title, author, description, url, img)
+        article = Article(cls.name, title, author, description, url, img)
+        if cls.article_cache is not None:
+            cls.article_cache.store(url, digest, article)
+        return article
 
     @classmethod
-    def _get_image(cls, soup):
-        return soup.find('meta', property='og:image')['content']
+    def _get_image(cls, page):
+        return page.meta['og:image']
 
     @classmethod
-    def _get_title(cls, soup):
-        return soup.find('meta', property='og:title')['content']
+    def _get_title(cls, page):
+        return page.meta['og:title']
 
     @classmethod
-    def _get_author(cls, soup):
+    def _get_author(cls, page):
         for author_tag in ['article:author', 'dc.creator', 'author']:
-            author = soup.find('meta', property=author_tag)
-            if author is None:
-                continue
-            return author['content']
+            if author_tag in page.meta:
+                return page.meta[author_tag]
         return None
 
     @classmethod
-    def _get_description(cls, soup):
-        return soup.find('meta', property='og:description')['content']
+    def _get_description(cls, page):
+        return page.meta['og:description']
 
     @classmethod
     def _remove_self_refs(cls, description):
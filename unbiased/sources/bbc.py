@@ -5,6 +5,7 @@ class BBC(NewsSource):
     name = 'BBC News'
     shortname = 'bbc'
     url = 'http://www.bbc.com/news/world/us_and_canada'
+    feed_url = 'http://feeds.bbci.co.uk/news/world/us_and_canada/rss.xml'
 
     bad_images = ['bbc_news_logo.png']
 
@@ -26,5 +27,5 @@ class BBC(NewsSource):
         return h1s, h2s, h3s
 
     @classmethod
-    def _get_image(cls, soup):
-        return soup.find('meta', property='og:image')['content'].replace('branded_news', 'cpsprodpb')
+    def _get_image(cls, page):
+        return page.meta['og:image'].replace('branded_news', 'cpsprodpb')
@@ -5,6 +5,7 @@ class CBS(NewsSource):
     name = 'CBS News'
     shortname = 'cbs'
     url = 'https://www.cbsnews.com/'
+    feed_url = 'https://www.cbsnews.com/latest/rss/main'
 
     bad_titles = ['60 Minutes']
     bad_descriptions = ['60 Minutes']
@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+
+import lxml.etree
+import lxml.html
+
+from unbiased.page import lxml_parser
+from unbiased.sources.base import NewsSource
+
+# settings a definition can have, besides 'tiers'
+SETTINGS = [
+    'name',
+    'shortname',
+    'url',
+    'bad_titles',
+    'bad_authors',
+    'bad_descriptions',
+    'bad_imgs',
+    'bad_urls',
+    'weight',
+    'refresh_interval',
+    'refresh_jitter',
+    'image_width',
+    'needs_article_body',
+    'keep_query_vars',
+    'feed_url',
+    'feed_tiers',
+]
+TIERS = ['h1s', 'h2s', 'h3s']
+
+# compiled selectors, by (kind, expression), shared by every source
+_selectors = {}
+_selectors_lock = threading.Lock()
+
+
+def compile_selector(xpath=None, css=None):
+    """
+    Compile an XPath expression, or a CSS selector (which needs the
+    'cssselect' package), into an lxml XPath evaluator.
+    """
+    if (xpath is None) == (css is None):
+        raise ValueError('A rule needs exactly one of "xpath" and "css"')
+    key = ('xpath', xpath) if xpath is not None else ('css', css)
+    with _selectors_lock:
+        selector = _selectors.get(key)
+        if selector is None:
+            if css is not None:
+                try:
+                    from cssselect import HTMLTranslator
+                except ImportError:
+                    raise ValueError('CSS selectors need the cssselect package: {}'.format(css))
+                xpath = HTMLTranslator().css_to_xpath(css)
+            selector = lxml.etree.XPath(xpath)
+            _selectors[key] = selector
+        return selector
+
+
+class Rule(object):
+    """
+    Where to find the urls of one tier on the home page: every match of
+    an XPath expression or CSS selector, reduced to the value of 'attr'
+    if it's an element, and sliced to [start:stop].
+    """
+
+    def __init__(self, xpath=None, css=None, attr='href', start=None, stop=None):
+        self.selector = compile_selector(xpath, css)
+        self.attr = attr
+        self.start = start
+        self.stop = stop
+
+    def urls(self, doc):
+        urls = []
+        for match in self.selector(doc):
+            if isinstance(match, lxml.etree._Element):
+                match = match.get(self.attr)
+            if match:
+                urls.append(str(match).strip())
+        return urls[self.start:self.stop]
+
+
+class DeclarativeSource(NewsSource):
+    """
+    A source whose home page is scraped by selector rules rather than
+    code. Subclasses set 'tiers' to {tier: [Rule]} for 'h1s', 'h2s' and
+    'h3s', and are usually made from a definition file by
+    'from_definition()'.
+    """
+
+    tiers = None
+
+    # query string variables to keep in article urls
+    keep_query_vars = None
+
+    @classmethod
+    def _fetch_urls(cls):
+        res = cls._download(cls.url)
+        parser = lxml_parser(lxml.html.HTMLParser, res.encoding)
+        doc = lxml.html.document_fromstring(res.content, parser=parser)
+        ret = []
+        for tier in TIERS:
+            urls = []
+            for rule in cls.tiers.get(tier, ()):
+                for url in rule.urls(doc):
+                    if url not in urls:
+                        urls.append(url)
+            ret.append(tuple(urls))
+        return tuple(ret)
+
+    @classmethod
+    def _normalize_url(cls, url, keep_query_vars=None):
+        if keep_query_vars is None:
+            keep_query_vars = cls.keep_query_vars
+        return super(DeclarativeSource, cls)._normalize_url(url, keep_query_vars)
+
+    @staticmethod
+    def from_definition(definition):
+        """
+        Make a source class from a definition, a dict of the SETTINGS of
+        the source plus 'tiers', which maps each tier to a rule or list
+        of rules, each a dict of Rule's arguments. For example:
+
+            {
+                "name": "Example News",
+                "shortname": "example",
+                "url": "https://example.com/",
+                "bad_urls": ["/opinion/"],
+                "tiers": {
+                    "h1s": {"css": "article.lead h2 a"},
+                    "h2s": {"xpath": "//section[@id='top']//h3/a/@href", "stop": 8}
+                }
+            }
+        """
+        definition = dict(definition)
+        tiers = definition.pop('tiers', None) or {}
+        unknown = set(definition) - set(SETTINGS)
+        unknown.update(set(tiers) - set(TIERS))
+        if unknown:
+            raise ValueError('Unknown source settings: {}'.format(sorted(unknown)))
+        for setting in ['name', 'shortname', 'url']:
+            if not definition.get(setting):
+                raise ValueError('Source definitions need a "{}"'.format(setting))
+        attrs = dict(definition)
+        attrs['tiers'] = {}
+        for tier, rules in tiers.items():
+            if isinstance(rules, dict):
+                rules = [rules]
+            attrs['tiers'][tier] = [Rule(**x) for x in rules]
+        class_name = ''.join(x for x in definition['shortname'].title() if x.isalnum()) + 'Source'
+        return type(class_name, (DeclarativeSource,), attrs)
+
+
+def load_definition(path):
+    """
+    Make a source class from the JSON, or YAML (which needs PyYAML),
+    definition file at 'path'.
+    """
+    with open(path) as fp:
+        if os.path.splitext(path)[1] in ['.yaml', '.yml']:
+            import yaml
+            definition = yaml.safe_load(fp)
+        else:
+            definition = json.load(fp)
+    try:
+        return DeclarativeSource.from_definition(definition)
+    except (TypeError, ValueError, SyntaxError, lxml.etree.XPathError) as ex:
+        raise ValueError('Bad source definition {}: {}'.format(path, ex))
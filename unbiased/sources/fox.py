@@ -5,6 +5,7 @@ class Fox(NewsSource):
     name = 'Fox News'
     shortname = 'Fox'
     url = 'http://www.foxnews.com'
+    feed_url = 'https://moxie.foxnews.com/google-publisher/latest.xml'
 
     bad_titles = ['O&#039;Reilly', 'Fox News', 'Brett Baier', 'Tucker']
     bad_descriptions = ['Sean Hannity']
@@ -8,10 +8,13 @@ class TheGuardian(NewsSource):
     name = 'The Guardian'
     shortname = 'Guardian'
     url = 'https://www.theguardian.com/us'
+    feed_url = 'https://www.theguardian.com/us/rss'
 
     bad_authors = ['Tom McCarthy', 'Andy Hunter']
     bad_urls = ['https://www.theguardian.com/profile/ben-jacobs']
 
+    needs_article_body = True
+
     _img_pat = re.compile('"srcsets":"(.*?)"')
 
     @classmethod
@@ -29,22 +32,27 @@ class TheGuardian(NewsSource):
         return h1s, h2s, h3s
 
     @classmethod
-    def _get_image(cls, soup):
+    def _get_image(cls, page):
         # the guardian watermarks the images in their <meta> tags,
         # and the <img> of the hero is a very small resolution,
         # but we can pull a hi-res image url out of the <script>
         # body inside of the page.
         try:
-            script = soup.find('script', id='gu').text
+            script = page.soup.find('script', id='gu').text
             matches = cls._img_pat.search(script)
             if matches:
                 srcsets = matches.group(1).split(',')
                 srcsets = sorted([(int(y.strip('w')), x.strip()) for x, y in [x.rsplit(' ', 1) for x in srcsets]])
+                # the smallest one that's still big enough, or the biggest
+                for width, src in srcsets:
+                    if width >= cls.image_width:
+                        return html.unescape(src)
                 return html.unescape(srcsets[-1][1])
         except Exception:
             pass
 
         # if that ugly, brittle shit fails, fall back on the low-res image
+        soup = page.soup
         if soup.find('img', class_='maxed'):
             img = soup.find('img', class_='maxed')['src']
         if soup.find('meta', itemprop='image'):
@@ -5,6 +5,7 @@ class NPR(NewsSource):
     name = 'NPR News'
     shortname = 'npr'
     url = 'http://www.npr.org/sections/news/'
+    feed_url = 'https://feeds.npr.org/1001/rss.xml'
 
     bad_titles = ['The Two-Way']
     bad_authors = ['Domenico Montanaro']
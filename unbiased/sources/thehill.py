@@ -10,6 +10,8 @@ class TheHill(NewsSource):
     bad_titles = ['THE MEMO']
     bad_authors = ['Matt Schlapp', 'Juan Williams', 'Judd Gregg']
 
+    needs_article_body = True
+
     @classmethod
     def _fetch_urls(cls):
         soup = cls._fetch_content(cls.url)
@@ -29,10 +31,10 @@ class TheHill(NewsSource):
         return h1s, h2s, h3s
 
     @classmethod
-    def _get_description(cls, soup):
+    def _get_description(cls, page):
         try:
-            return NewsSource._get_description(soup)
+            return NewsSource._get_description(page)
         except Exception:
             # fall back on grabbing text from the article
-            desc = soup.find('div', class_='field-items')
+            desc = page.soup.find('div', class_='field-items')
             return desc.text[:200].rsplit(' ', 1)[0]
@@ -1,113 +1,302 @@
-import io
-import logging
-import os
-import pkgutil
-import random
-import shutil
-import time
-
-from PIL import Image
-import requests
-
-logger = logging.getLogger('unbiased')
-
-
-def pick_randoms(story_lists, length, per_source):
-    """
-    Return a randomly chosen list of 'length' stories, picking at
-    most 'per_source' stories from each source.
-    """
-    # TODO: weighting is incorrect if a source has fewer than 'per_source' articles
-    urandom = random.SystemRandom()
-    candidates = []
-    for stories in story_lists:
-        indexes = list(range(len(stories)))
-        urandom.shuffle(indexes)
-        random_indexes = indexes[:per_source]
-        candidates.extend([stories[x] for x in random_indexes])
-    indexes = list(range(len(candidates)))
-    urandom.shuffle(indexes)
-    random_indexes = indexes[:length]
-    return tuple(candidates[x] for x in random_indexes)
-
-
-def pickStories(newsSourceArr):
-    h1s = pick_randoms([x.h1s for x in newsSourceArr], 4, 1)
-    h2s = pick_randoms([x.h2s for x in newsSourceArr], 6, 2)
-    h3s = pick_randoms([x.h3s for x in newsSourceArr], 12, 2)
-    return h1s, h2s, h3s
-
-
-def buildOutput(top_stories, middle_stories, bottom_stories):
-    # read in the template html file
-    from jinja2 import Environment, PackageLoader, select_autoescape
-    env = Environment(
-        loader=PackageLoader('unbiased', 'html_template'),
-        autoescape=select_autoescape(['html', 'xml'])
-    )
-    template = env.get_template('unbiased.jinja.html')
-
-    timestamp = time.strftime("%a, %b %-d, %-I:%M%P %Z", time.localtime())
-    utime = int(time.time())
-
-    sourcesStr = ', '.join(set([x.source for x in top_stories] + [x.source for x in middle_stories] + [x.source for x in bottom_stories]))
-
-    html = template.render(
-        timestamp=timestamp,
-        utime=utime,
-        top_stories=top_stories,
-        middle_stories=middle_stories,
-        bottom_stories=bottom_stories,
-        sources=sourcesStr,
-    )
-
-    return html
-
-
-def write_files(files_to_write, outDir):
-    for name, bytesio in files_to_write.items():
-        with open(os.path.join(outDir, name), 'wb') as fp:
-            shutil.copyfileobj(bytesio, fp)
-
-
-def write_static_files(outDir):
-    # copy over static package files
-    for filename in ['unbiased.css', 'favicon.ico', 'favicon.png', 'apple-touch-icon.png']:
-        data = pkgutil.get_data('unbiased', os.path.join('html_template', filename))
-        with open(os.path.join(outDir, filename), 'wb') as fp:
-            fp.write(data)
-
-
-def pullImage(url, index, webroot, target_width=350, target_height=200):
-    res = requests.get(url, timeout=3)
-    if res.status_code == 200:
-        content = res.content
-    else:
-        logger.debug('Image not found: url={}'.format(url))
-        return ''
-    img = Image.open(io.BytesIO(content))
-    # crop to aspect ratio
-    target_ar = target_width / target_height
-    left, top, right, bottom = img.getbbox()
-    height = bottom - top
-    width = right - left
-    ar = width / height
-    if target_ar > ar:
-        new_height = (target_height / target_width) * width
-        bbox = (left, top + ((height - new_height) / 2), right, bottom - ((height - new_height) / 2))
-        img = img.crop(bbox)
-    elif target_ar < ar:
-        new_width = (target_width / target_height) * height
-        bbox = (left + ((width - new_width) / 2), top, right - ((width - new_width) / 2), bottom)
-        img = img.crop(bbox)
-    # resize if larger
-    if target_width * 2 < width or target_height * 2 < height:
-        img = img.resize((target_width * 2, target_height * 2), Image.LANCZOS)
-    # TODO: fill with a neutral color instead of just discarding alpha channel
-    img = img.convert('RGB')
-    # TODO: create retina images
-    jpg_name = 'img{}.jpg'.format(index)
-    jpg_file = io.BytesIO()
-    img.save(jpg_file, 'JPEG')
-    jpg_file.seek(0)
-    return jpg_name, jpg_file
+import collections
+import hashlib
+import heapq
+import io
+import logging
+import math
+import os
+import random
+import time
+
+from PIL import Image
+
+from unbiased import fetch
+from unbiased.cluster import cluster_stories
+from unbiased.publish import IMAGE_DIR
+
+logger = logging.getLogger('unbiased')
+
+
+# the random number generator stories are picked with. it doesn't need to
+# be unpredictable, just fast, and seedable so picks can be repeated.
+_random = random.Random()
+
+
+def seed_picker(seed=None):
+    """
+    Seed the story picker, so the same sources give the same picks, or
+    reseed it from the OS if 'seed' is None.
+    """
+    _random.seed(seed)
+
+
+def _sample(stories, rng):
+    """
+    Yield the items of 'stories' in random order, for as long as they're
+    asked for. A partial Fisher-Yates shuffle that only remembers the
+    swaps it makes, so taking k items costs O(k) however many there are.
+    """
+    swaps = {}
+    for i in range(len(stories)):
+        j = rng.randrange(i, len(stories))
+        x = swaps.get(j, j)
+        swaps[j] = swaps.get(i, i)
+        yield stories[x]
+
+
+def pick_randoms(story_lists, length, per_source, clusters=None, weights=None, rng=None):
+    """
+    Return a randomly chosen list of 'length' stories, picking at
+    most 'per_source' stories from each source, and at most one story
+    from each cluster in 'clusters' ({story: cluster}, see
+    unbiased.cluster).
+
+    Sources are picked first, with a chance in proportion to their
+    entry in 'weights' (1 each by default) however many stories they
+    have, and then a story from the picked source. Every source has
+    'per_source' slots, each with a weighted random key (Efraimidis and
+    Spirakis' A-ES), and the slots are taken best key first, skipping
+    sources that have run out of stories.
+    """
+    if rng is None:
+        rng = _random
+    if weights is None:
+        weights = [1] * len(story_lists)
+    slots = []
+    for i, (stories, weight) in enumerate(zip(story_lists, weights)):
+        if not stories or weight <= 0:
+            continue
+        for _ in range(per_source):
+            # log(u) / w orders the same as u ** (1 / w), without underflow
+            slots.append((-math.log(1.0 - rng.random()) / weight, i))
+    heapq.heapify(slots)
+    samplers = {}
+    picked = []
+    seen = set()
+    while slots and len(picked) < length:
+        _, i = heapq.heappop(slots)
+        if i not in samplers:
+            samplers[i] = _sample(story_lists[i], rng)
+        for story in samplers[i]:
+            cluster = clusters.get(story) if clusters is not None else None
+            if cluster is None or cluster not in seen:
+                seen.add(cluster)
+                picked.append(story)
+                break
+    return tuple(picked)
+
+
+def pickStories(newsSourceArr):
+    clusters = cluster_stories(x for source in newsSourceArr for tier in [source.h1s, source.h2s, source.h3s] for x in tier)
+    weights = [x.weight for x in newsSourceArr]
+    h1s = pick_randoms([x.h1s for x in newsSourceArr], 4, 1, clusters, weights)
+    h2s = pick_randoms([x.h2s for x in newsSourceArr], 6, 2, clusters, weights)
+    h3s = pick_randoms([x.h3s for x in newsSourceArr], 12, 2, clusters, weights)
+    return h1s, h2s, h3s
+
+
+_template = None
+
+
+def setup_templates(bytecode_cache_dir=None):
+    """
+    Build the jinja environment and compile the page template. Happens
+    once, on first use, unless called again. With 'bytecode_cache_dir',
+    the compiled template is also kept on disk between restarts.
+    """
+    global _template
+    from jinja2 import Environment, FileSystemBytecodeCache, PackageLoader, select_autoescape
+    bytecode_cache = None
+    if bytecode_cache_dir is not None:
+        os.makedirs(bytecode_cache_dir, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+    env = Environment(
+        loader=PackageLoader('unbiased', 'html_template'),
+        autoescape=select_autoescape(['html', 'xml']),
+        bytecode_cache=bytecode_cache,
+        # the package can't change under a running process
+        auto_reload=False,
+    )
+    _template = env.get_template('unbiased.jinja.html')
+    return _template
+
+
+def buildOutput(top_stories, middle_stories, bottom_stories):
+    template = _template or setup_templates()
+
+    timestamp = time.strftime("%a, %b %-d, %-I:%M%P %Z", time.localtime())
+
+    sourcesStr = ', '.join(set([x.source for x in top_stories] + [x.source for x in middle_stories] + [x.source for x in bottom_stories]))
+
+    html = template.render(
+        timestamp=timestamp,
+        top_stories=top_stories,
+        middle_stories=middle_stories,
+        bottom_stories=bottom_stories,
+        sources=sourcesStr,
+    )
+
+    return html
+
+
+# image formats to write every picture in, best first, and their
+# file extensions. jpeg must stay last, it's the fallback for old browsers.
+IMAGE_FORMATS = [('avif', 'AVIF', 'avif'), ('webp', 'WEBP', 'webp'), ('jpeg', 'JPEG', 'jpg')]
+
+# pixel densities to write every picture at
+IMAGE_DENSITIES = [1, 2]
+
+
+class Picture(collections.namedtuple('Picture', ['name', 'formats'])):
+    """
+    A set of renditions of one image, named 'name' plus a density suffix
+    and the extension of each format in 'formats'.
+    """
+
+    def src(self, fmt, density=1):
+        suffix = '' if density == 1 else '@{}x'.format(density)
+        return '{}{}.{}'.format(self.name, suffix, _image_extensions[fmt])
+
+    def srcset(self, fmt):
+        return ', '.join('{} {}x'.format(self.src(fmt, x), x) for x in IMAGE_DENSITIES)
+
+    def files(self):
+        return [self.src(fmt, x) for fmt in self.formats for x in IMAGE_DENSITIES]
+
+
+_image_extensions = {name: ext for name, _, ext in IMAGE_FORMATS}
+_pil_formats = {name: pil_name for name, pil_name, _ in IMAGE_FORMATS}
+
+
+def image_formats():
+    """
+    The formats from IMAGE_FORMATS that this build of Pillow can write.
+    """
+    Image.init()
+    return tuple(name for name, pil_name, _ in IMAGE_FORMATS if pil_name in Image.SAVE)
+
+
+def image_name(url, target_width, target_height):
+    """
+    Derived images are named by a hash of their source url and size, so
+    they never change once written and can be cached forever.
+    """
+    key = '{} {}x{}'.format(url, target_width, target_height)
+    return '{}/{}'.format(IMAGE_DIR, hashlib.sha1(key.encode('utf8')).hexdigest())
+
+
+# largest source image we're willing to decode
+max_image_pixels = 50 * 1000 * 1000
+
+
+def check_image_head(head):
+    """
+    Look at the start of an image download. Returns True once the image's
+    dimensions are known and it's small enough to download the rest.
+    """
+    try:
+        img = Image.open(io.BytesIO(head))
+    except Exception:
+        # not enough of it yet
+        return False
+    width, height = img.size
+    if width * height > max_image_pixels:
+        raise fetch.DownloadAborted('Image too large: {}x{}'.format(width, height))
+    return True
+
+
+def pullImage(url, webroot, target_width=350, target_height=200):
+    """
+    Return the Picture for the image at 'url', and the downloaded image
+    to make it from, or None if it is already in the webroot.
+    """
+    picture = Picture(image_name(url, target_width, target_height), image_formats())
+    if all(os.path.exists(os.path.join(webroot, x)) for x in picture.files()):
+        logger.debug('Image unchanged: url={}'.format(url))
+        return picture, None
+    res = fetch.get(url, check_head=check_image_head)
+    if res.status_code == 200:
+        content = res.content
+    else:
+        logger.debug('Image not found: url={}'.format(url))
+        return None, None
+    return picture, content
+
+
+def transcode_image(content, picture, target_width, target_height):
+    """
+    Write every rendition of 'picture' from the downloaded image in
+    'content'. Returns a dict of file name to image data. This is plain
+    CPU work, so it can be run in another process.
+    """
+    img = resize_image(content, target_width, target_height)
+    renditions = {}
+    for density in sorted(IMAGE_DENSITIES, reverse=True):
+        width = target_width * density
+        height = target_height * density
+        if img.width > width or img.height > height:
+            img = img.resize((width, height), _resample_filter(img.width / width))
+        renditions[density] = img
+    files = {}
+    for fmt in picture.formats:
+        for density, img in renditions.items():
+            data = io.BytesIO()
+            img.save(data, _pil_formats[fmt])
+            files[picture.src(fmt, density)] = data.getvalue()
+    return files
+
+
+def _resample_filter(ratio):
+    """
+    Pick a resampling filter for shrinking an image by 'ratio'. The more
+    an image is shrunk, the less a better filter is visible in the result.
+    """
+    if ratio >= 3:
+        return Image.BOX
+    if ratio >= 1.5:
+        return Image.BILINEAR
+    return Image.LANCZOS
+
+
+def resize_image(content, target_width, target_height):
+    """
+    Crop the image in 'content' to the target aspect ratio and shrink it
+    to retina size (twice the target size). Returns an RGB image.
+    """
+    out_width = target_width * 2
+    out_height = target_height * 2
+    img = Image.open(io.BytesIO(content))
+    # have the jpeg decoder scale the image down by 1/2, 1/4 or 1/8 while
+    # decoding, as far as it can without the crop dropping below retina
+    # size. this is a no-op for other formats.
+    width, height = img.size
+    scale = max(out_width / width, out_height / height)
+    if scale < 1:
+        img.draft(img.mode, (math.ceil(width * scale), math.ceil(height * scale)))
+    # crop to aspect ratio
+    target_ar = target_width / target_height
+    left, top, right, bottom = img.getbbox()
+    height = bottom - top
+    width = right - left
+    ar = width / height
+    if target_ar > ar:
+        new_height = (target_height / target_width) * width
+        bbox = (left, top + ((height - new_height) / 2), right, bottom - ((height - new_height) / 2))
+        img = img.crop(bbox)
+    elif target_ar < ar:
+        new_width = (target_width / target_height) * height
+        bbox = (left + ((width - new_width) / 2), top, right - ((width - new_width) / 2), bottom)
+        img = img.crop(bbox)
+    # resize if larger
+    width, height = img.size
+    if out_width < width or out_height < height:
+        ratio = min(width / out_width, height / out_height)
+        # formats that can't be drafted can still be shrunk cheaply by an
+        # integer factor before the real resample (Pillow >= 7)
+        factor = int(ratio)
+        if factor >= 2 and hasattr(img, 'reduce'):
+            img = img.reduce(factor)
+            ratio /= factor
+        img = img.resize((out_width, out_height), _resample_filter(ratio))
+    # TODO: fill with a neutral color instead of just discarding alpha channel
+    return img.convert('RGB')